@@ -23,6 +23,7 @@ CHANGELOG = open(os.path.join(HERE, 'CHANGES.rst')).read()
 
 
 REQUIRES = [
+    'futures; python_version < "3"',
     'repoze.who>=2.3',
     'ldap3>=2.4.1',
     'setuptools',
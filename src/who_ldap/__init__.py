@@ -17,21 +17,39 @@ LDAP plugins for repoze.who v2 API
 """
 
 from base64 import b64encode, b64decode
+import binascii
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import heapq
+import itertools
+import os
+import random
+import socket
+import ssl
 try:  # pragma: nocover
     from urllib.parse import urlparse  # Python 3
 except ImportError:  # pragma: nocover
     from urlparse import urlparse  # Python 2
 import re
+from string import Formatter, hexdigits
+import threading
+import time
+import weakref
 
 from ldap3 import (
     Server,
     Connection,
+    Tls,
     ALL_ATTRIBUTES,
     SUBTREE,
     LEVEL,
     BASE
 )
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPExceptionError
+from ldap3.core.tls import check_hostname
 from ldap3.utils.conv import escape_filter_chars
+from ldap3.utils.dn import escape_rdn, parse_dn
 from repoze.who.interfaces import IAuthenticator, IMetadataProvider
 from zope.interface import implementer
 import logging
@@ -43,18 +61,216 @@ except NameError:
     string_types = str  # Python 3
 
 
+# DN saved in the userdata of an identity, see save_userdata. The regular
+# expression is no longer used (see parse_userdata) and only kept for the
+# modules importing it.
 DNRX = re.compile('<dn:(?P<b64dn>[A-Za-z0-9+/]+=*)>')
+DN_TOKEN = '<dn:'
 
+# Whitespace between the components of a search filter
+FILTER_SPACE_RX = re.compile(r'(?<=[()&|!])\s+(?=[()&|!])')
+# Left hand side of a comparison, an extensible match included, e.g.
+# (cn~=x), (cn:dn:caseExactMatch:=x) or (:dn:2.4.6.8.10:=x)
+FILTER_ITEM_RX = re.compile(
+    r'^(?:[A-Za-z0-9][\w.;-]*(?:[~<>]?|(?::[dD][nN])?(?::[\w.-]+)?:)'
+    r'|(?::[dD][nN])?:[A-Za-z0-9][\w.-]*:)=')
+FILTER_VALUE_RX = re.compile(r'=([^()]*)\)')
+PERCENT_FIELD_RX = re.compile(r'%\((\w+)\)s|%%')
+FORMAT_FIELD_RX = re.compile(r'^identity((?:\[[^\]]+\])+)$')
 
-def make_connection(url, bind_dn, bind_pass):
+TLS_VALIDATE = {
+    'none': ssl.CERT_NONE,
+    'optional': ssl.CERT_OPTIONAL,
+    'required': ssl.CERT_REQUIRED,
+}
+
+# Threads shared by all plugins to run LDAP operations concurrently
+EXECUTOR_WORKERS = 32
+_executor = None
+_executor_lock = threading.Lock()
+
+# LDAP clients shared by all plugins, see get_client
+_clients = {}
+_clients_lock = threading.Lock()
+
+# Limits of concurrent operations shared by all clients of the same servers,
+# see AdmissionControl
+_admissions = {}
+
+# TLS configurations shared by all clients of the same server with the same
+# TLS settings, see get_tls
+_tls = {}
+_tls_lock = threading.Lock()
+
+# Order in which queued operations are admitted, lowest first
+PRIORITY_AUTHENTICATION = 0
+PRIORITY_METADATA = 1
+
+# Process owning the threads and connections above, see check_fork
+_pid = os.getpid()
+# Whether the clients of a forked child are still to be warmed up again
+_rewarm = False
+
+# Objects of the plugins holding locks, which a forked child resets
+_forkables = weakref.WeakSet()
+
+
+def make_server(url, tls=None):
     """
-    Makes a LDAP Connection
+    Makes a LDAP Server
     """
     uri = urlparse(url)
     ssl = uri.scheme == 'ldaps'
     port = uri.port or (636 if ssl else 389)
-    server = Server(uri.hostname, port=port, use_ssl=ssl)
-    return Connection(server, bind_dn, bind_pass)
+    return Server(uri.hostname, port=port, use_ssl=ssl, tls=tls)
+
+
+def make_connection(url, bind_dn, bind_pass):
+    """
+    Makes a LDAP Connection
+    """
+    return Connection(make_server(url), bind_dn, bind_pass)
+
+
+def reset_fork():
+    """
+    Forgets the threads, connections and locks inherited from the parent
+    process once in a forked child, without connecting yet
+    """
+    global _pid, _executor, _executor_lock, _clients_lock, _tls_lock, \
+        _rewarm
+    if os.getpid() == _pid:
+        return
+    _pid = os.getpid()
+    _executor = None
+    _executor_lock = threading.Lock()
+    _clients_lock = threading.Lock()
+    _tls_lock = threading.Lock()
+    server_health.forked()
+    for forkable in list(_forkables):
+        forkable.forked()
+    for admission in list(_admissions.values()):
+        admission.forked()
+    for client in list(_clients.values()):
+        client.forked()
+    _rewarm = True
+
+
+def check_fork():
+    """
+    Resets the state inherited from the parent process once in a forked
+    child (see reset_fork), then warms the clients up again in the
+    background the first time they are used there
+    """
+    global _rewarm
+    reset_fork()
+    if not _rewarm:
+        return
+    with _clients_lock:
+        rewarm, _rewarm = _rewarm, False
+        clients = list(_clients.values())
+    if rewarm:
+        for client in clients:
+            client.warm_up_background()
+
+
+if hasattr(os, 'register_at_fork'):  # pragma: nocover
+    # Python 3.7+, otherwise the fork is noticed when using a client. Forked
+    # children that never use a client (e.g. daemonizing or multiprocessing
+    # ones) don't connect.
+    os.register_at_fork(after_in_child=reset_fork)
+
+
+def get_client(url, bind_dn='', bind_pass='', start_tls=False, pool_size=10,
+               tls_ca_file=None, tls_ciphers=None, tls_validate=None,
+               max_concurrency=0, max_queue=None, queue_timeout=None,
+               idle_timeout=None):
+    """
+    Returns the LDAP client shared by all the plugins using the same
+    servers, operating user and TLS settings
+
+    The pool of the client keeps the largest of the requested sizes, and
+    the smallest of the idle timeouts.
+    The clients of the same servers share their AdmissionControl, whatever
+    their operating user.
+    """
+    check_fork()
+    urls = tuple(parse_urls(url))
+    tls_validate = (tls_validate or 'none').lower()
+    key = (urls, bind_dn or '', bind_pass or '', bool(start_tls),
+           tls_ca_file or None, tls_ciphers or None, tls_validate)
+    with _clients_lock:
+        admission = _admissions.get(urls)
+        if admission is None:
+            admission = _admissions[urls] = AdmissionControl(' '.join(urls))
+        admission.limit(max_concurrency, max_queue, queue_timeout)
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = LDAPClient(
+                urls, bind_dn, bind_pass, start_tls, pool_size,
+                tls_ca_file, tls_ciphers, tls_validate, admission)
+        else:
+            client.pool.size = max(client.pool.size, int(pool_size))
+        client.pool.expire(idle_timeout)
+        return client
+
+
+def get_tls(url, tls_validate=None, tls_ca_file=None, tls_ciphers=None):
+    """
+    Returns the ReusableTls shared by all the clients of the server at url
+    with the same TLS settings, so that they resume each other's sessions
+    """
+    tls_validate = (tls_validate or 'none').lower()
+    key = (url, tls_validate, tls_ca_file or None, tls_ciphers or None)
+    with _tls_lock:
+        tls = _tls.get(key)
+        if tls is None:
+            tls = _tls[key] = ReusableTls(
+                urlparse(url).hostname, tls_validate, tls_ca_file,
+                tls_ciphers)
+        return tls
+
+
+def get_executor():
+    """
+    Returns the thread pool used to run LDAP operations concurrently
+    """
+    global _executor
+    check_fork()
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS)
+        return _executor
+
+
+def parse_list(value):
+    """
+    Parses a list of values, one per line (as DNs may contain commas)
+    """
+    if not value:
+        return []
+    if isinstance(value, string_types):
+        value = value.splitlines()
+    return [item.strip() for item in value if item and item.strip()]
+
+
+def parse_count(value):
+    """
+    Parses a count, where a flag set stands for 1 and unset for 0
+    """
+    value = str(value or 0).strip()
+    if value[:1].lower() in ('t', 'f'):
+        return int(value[:1].lower() == 't')
+    return int(value)
+
+
+def parse_urls(url):
+    """
+    Parses a list of server URLs, separated by whitespace
+    """
+    if isinstance(url, string_types):
+        url = url.split()
+    return list(url or [])
 
 
 def parse_map(mapstr):
@@ -71,14 +287,260 @@ def parse_map(mapstr):
     return result
 
 
-def extract_userdata(identity):
+def parse_userdata(identity, environ=None):
+    """
+    Returns the fields of the user data of the identity
+
+    Fields of the old string format are parsed once per request, as the
+    result is kept in the environ (if given) for the other plugins.
+    """
     userdata = identity.get('userdata')
     if isinstance(userdata, dict):  # New user data format
-        return userdata.get('dn')
-    elif isinstance(userdata, string_types):  # Old user data format
-        match = DNRX.search(userdata)
-        if match:
-            return b64decode(match.group('b64dn')).decode('utf-8')
+        return userdata
+    if not userdata or not isinstance(userdata, string_types):
+        return {}
+    parsed = environ.get('who_ldap.userdata') if environ else None
+    if parsed and parsed[0] == userdata:
+        return parsed[1]
+    # Old user data format, looking for <dn:BASE64>
+    fields = {}
+    start = userdata.find(DN_TOKEN)
+    end = userdata.find('>', start)
+    if start >= 0 and end > 0:
+        try:
+            dn = b64decode(
+                userdata[start + len(DN_TOKEN):end]).decode('utf-8')
+        except (binascii.Error, TypeError, UnicodeDecodeError):
+            dn = None
+        if dn:
+            fields['dn'] = dn
+    if environ is not None:
+        environ['who_ldap.userdata'] = (userdata, fields)
+    return fields
+
+
+def extract_userdata(identity, environ=None):
+    return parse_userdata(identity, environ).get('dn')
+
+
+def check_filter(filterstr, start=0):
+    """
+    Checks the syntax of the search filter (RFC 4515) at start, returning
+    where it ends
+
+    The absolute true and false filters of RFC 4526, (&) and (|), are
+    refused as ldap3 can't send them.
+    """
+    def fail():
+        raise ValueError(u'Invalid search filter: %s' % filterstr)
+    if filterstr[start:start + 1] != '(':
+        fail()
+    i = start + 1
+    if filterstr[i:i + 1] in ('&', '|'):
+        i += 1
+        if filterstr[i:i + 1] != '(':
+            fail()
+        while filterstr[i:i + 1] == '(':
+            i = check_filter(filterstr, i)
+    elif filterstr[i:i + 1] == '!':
+        i = check_filter(filterstr, i + 1)
+    else:
+        end = filterstr.find(')', i)
+        if end < 0 or '(' in filterstr[i:end] \
+                or not FILTER_ITEM_RX.match(filterstr[i:end]):
+            fail()
+        i = end
+    if filterstr[i:i + 1] != ')':
+        fail()
+    return i + 1
+
+
+class FilterTemplate(object):
+    """
+    Search filter with placeholders, parsed and validated once
+
+    Placeholders are either like ``{identity[key]}`` (``str.format`` style,
+    keys may be nested) or like ``%(key)s`` (``'%'`` style). Rendering
+    replaces them with the escaped values of the fields they name, after
+    the whitespace between the components of the filter has been removed,
+    so the same values always give the same filter string.
+    """
+
+    def __init__(self, template, style='format', fields=None):
+        """
+        Parameters:
+        template -- search filter with placeholders
+        style -- 'format' or '%'
+        fields -- names of the fields allowed, if restricted
+        """
+        self.template = template
+        if style == 'format':
+            parts = self._parse_format(template)
+        else:
+            parts = self._parse_percent(template)
+        literals = [FILTER_SPACE_RX.sub('', literal) for literal, _ in parts]
+        literals[0] = literals[0].lstrip()
+        literals[-1] = literals[-1].rstrip()
+        self.parts = [(literal, path)
+                      for literal, (_, path) in zip(literals, parts)]
+        self.fields = tuple(path for _, path in self.parts if path)
+
+        for path in self.fields:
+            if fields is not None and path[0] not in fields:
+                raise ValueError(u'Unknown field in search filter: %s'
+                                 % '.'.join(path))
+        probe = ''.join(
+            literal + ('x' if path else '') for literal, path in self.parts)
+        try:
+            valid = check_filter(probe) == len(probe)
+        except ValueError:
+            valid = False
+        if not valid:
+            raise ValueError(u'Invalid search filter: %s' % template)
+
+    def _parse_format(self, template):
+        parts = []
+        for literal, field, spec, conversion in Formatter().parse(template):
+            path = None
+            if field is not None:
+                match = FORMAT_FIELD_RX.match(field)
+                if not match or spec or conversion:
+                    raise ValueError(
+                        u'Unsupported placeholder in search filter: {%s}'
+                        % field)
+                path = tuple(match.group(1)[1:-1].split(']['))
+            parts.append((literal, path))
+        if not parts or parts[-1][1]:
+            parts.append(('', None))
+        return parts
+
+    def _parse_percent(self, template):
+        parts = []
+        literal = ''
+        last = 0
+        for match in PERCENT_FIELD_RX.finditer(template):
+            literal += template[last:match.start()]
+            last = match.end()
+            if match.group(1) is None:
+                literal += '%'
+                continue
+            parts.append((literal, (match.group(1),)))
+            literal = ''
+        if '%' in template[last:]:
+            raise ValueError(u'Unsupported placeholder in search filter: %s'
+                             % template)
+        parts.append((literal + template[last:], None))
+        return parts
+
+    def render(self, values):
+        """
+        Returns the search filter for the fields in values,
+        or None if one of them is missing
+        """
+        result = []
+        for literal, path in self.parts:
+            result.append(literal)
+            if path:
+                value = values
+                for key in path:
+                    try:
+                        value = value[key]
+                    except (KeyError, IndexError, TypeError):
+                        return
+                if isinstance(value, bytes):
+                    value = value.decode('utf-8')
+                result.append(escape_filter_chars(u'%s' % value))
+        return u''.join(result)
+
+
+def is_dn_template(template):
+    """
+    Returns whether a DN template has {login} fields, and no other one
+    """
+    try:
+        fields = set((name, spec, conversion) for _, name, spec, conversion
+                     in Formatter().parse(template) if name is not None)
+    except ValueError:
+        return False
+    return fields == set([('login', '', None)])
+
+
+def unescape_rdn(value):
+    """
+    Returns an attribute value of a DN without its escapes (RFC 4514)
+    """
+    result = bytearray()
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char == '\\':
+            pair = value[i + 1:i + 3]
+            if len(pair) == 2 and all(c in hexdigits for c in pair):
+                result.append(int(pair, 16))
+                i += 3
+                continue
+            i += 1
+            char = value[i:i + 1]
+        result.extend(char.encode('utf-8'))
+        i += 1
+    return result.decode('utf-8')
+
+
+def login_key(login):
+    """
+    Returns a login in a form suitable for comparisons, as the naming
+    attributes match regardless of case and outer spaces
+    """
+    return login.strip().lower()
+
+
+def dn_key(dn):
+    """
+    Returns a DN in a form suitable for comparisons
+    """
+    try:
+        return u''.join(u'%s=%s%s' % component
+                        for component in parse_dn(dn, strip=True)).lower()
+    except LDAPExceptionError:
+        return dn.lower()
+
+
+def dn_components(dn):
+    """
+    Returns the attributes and values of the RDNs of a DN, in lower case,
+    the values unescaped
+    """
+    return [(attribute.lower(), unescape_rdn(value).lower())
+            for attribute, value, separator in parse_dn(dn, strip=True)]
+
+
+def normalize_filter(filterstr):
+    """
+    Returns a search filter with its values replaced by '?' (but for
+    presence tests), so that the searches made with the same filter compare
+    equal and don't disclose the values searched for
+    """
+    return FILTER_VALUE_RX.sub(
+        lambda m: '=*)' if m.group(1) == '*' else '=?)',
+        FILTER_SPACE_RX.sub('', filterstr))
+
+
+def mask_dn(dn):
+    """
+    Returns a DN with the values of its first RDN replaced by '?', so that
+    the DN of a user doesn't disclose their login
+    """
+    try:
+        components = parse_dn(dn, strip=True)
+    except LDAPExceptionError:
+        return u'?'
+    masked = []
+    first = True
+    for attribute, value, separator in components:
+        masked.append(u'%s=%s%s' % (
+            attribute, u'?' if first else value, separator))
+        first = first and separator == '+'
+    return u''.join(masked)
 
 
 def save_userdata(identity, dn):
@@ -86,8 +548,966 @@ def save_userdata(identity, dn):
     if isinstance(userdata, dict):  # New user data format
         identity['userdata']['dn'] = dn
     elif isinstance(userdata, string_types):  # Old data user format
-        encoded = '<dn:%s>' % b64encode(dn.encode('utf-8')).decode('ascii')
-        identity['userdata'] = userdata + encoded
+        # Replaces the DN already saved, if any
+        start = userdata.find(DN_TOKEN)
+        end = userdata.find('>', start)
+        if start >= 0 and end > 0:
+            userdata = userdata[:start] + userdata[end + 1:]
+        identity['userdata'] = u'%s%s%s>' % (
+            userdata,
+            DN_TOKEN,
+            b64encode(dn.encode('utf-8')).decode('ascii'))
+
+
+class LRUCache(object):
+    """
+    Thread-safe mapping bounded to ``maxsize`` entries, evicting the least
+    recently used ones first
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = int(maxsize)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _forkables.add(self)
+
+    def forked(self):
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+
+class SlidingWindowCounter(object):
+    """
+    Counts recent failures per key and tells when a key must back off
+
+    Failures older than ``window`` seconds are forgotten. Once a key reaches
+    ``max_failures``, it is refused for ``backoff`` seconds after its last
+    failure, a delay which doubles with every further failure up to
+    ``max_backoff``. At most ``maxsize`` keys are tracked.
+    """
+
+    def __init__(self, max_failures, window=300, backoff=1, max_backoff=300,
+                 maxsize=10000):
+        self.max_failures = int(max_failures)
+        self.window = float(window)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        # Enough history to reach max_backoff, older failures don't matter
+        self._keep = self.max_failures + 64
+        self._failures = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        _forkables.add(self)
+
+    def forked(self):
+        self._lock = threading.Lock()
+
+    def _recent(self, key, now):
+        horizon = now - self.window
+        return [t for t in self._failures.get(key, ()) if t > horizon]
+
+    def allows(self, key, now=None):
+        now = time.time() if now is None else now
+        recent = self._recent(key, now)
+        excess = len(recent) - self.max_failures
+        if excess < 0:
+            return True
+        delay = min(self.backoff * 2 ** excess, self.max_backoff)
+        return now >= recent[-1] + delay
+
+    def failed(self, key, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            recent = self._recent(key, now)
+            recent.append(now)
+            self._failures.set(key, recent[-self._keep:])
+
+    def reset(self, key):
+        self._failures.pop(key)
+
+
+class AuthenticationThrottle(object):
+    """
+    Refuses authentication attempts for logins and clients (``REMOTE_ADDR``)
+    which failed too often recently, so brute-force attempts don't turn
+    into LDAP binds
+
+    Either limit is disabled when set to 0. ``shed`` counts refused attempts
+    per kind ('login' or 'client').
+    """
+
+    def __init__(self,
+                 max_login_failures=0,
+                 max_client_failures=0,
+                 window=300,
+                 backoff=1,
+                 max_backoff=300,
+                 maxsize=10000):
+        self.counters = {}
+        for kind, max_failures in (('login', max_login_failures),
+                                   ('client', max_client_failures)):
+            if max_failures and int(max_failures) > 0:
+                self.counters[kind] = SlidingWindowCounter(
+                    max_failures, window, backoff, max_backoff, maxsize)
+        self.shed = dict.fromkeys(self.counters, 0)
+        self._lock = threading.Lock()
+        _forkables.add(self)
+
+    def forked(self):
+        self._lock = threading.Lock()
+
+    def _keys(self, environ, login):
+        return (('login', login_key(login)),
+                ('client', environ.get('REMOTE_ADDR')))
+
+    def allows(self, environ, login):
+        if not self.counters:
+            return True
+        for kind, key in self._keys(environ, login):
+            counter = self.counters.get(kind)
+            if counter is None or key is None or counter.allows(key):
+                continue
+            with self._lock:
+                self.shed[kind] += 1
+            environ['who_ldap.throttled'] = kind
+            logging.getLogger('repoze.who').warning(
+                'Too many failed attempts for %s %s, not authenticating',
+                kind, key)
+            return False
+        return True
+
+    def failed(self, environ, login):
+        for kind, key in self._keys(environ, login):
+            counter = self.counters.get(kind)
+            if counter is not None and key is not None:
+                counter.failed(key)
+
+    def succeeded(self, environ, login):
+        # Only the login is forgiven: a client may be guessing other logins
+        counter = self.counters.get('login')
+        if counter is not None:
+            counter.reset(login_key(login))
+
+
+class ConnectionPool(object):
+    """
+    Keeps up to ``size`` idle connections made by ``factory``, so operations
+    don't pay for a connection and a bind every time
+
+    Connections left idle for more than ``idle_timeout`` seconds are dropped
+    rather than reused, as the server may have closed them meanwhile.
+    """
+
+    def __init__(self, factory, size=10, idle_timeout=60):
+        self.factory = factory
+        self.size = int(size)
+        self.idle_timeout = float(idle_timeout)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._default_idle_timeout = True
+
+    def expire(self, idle_timeout):
+        """
+        Applies the idle_timeout of a plugin: the smallest one configured,
+        replacing the default
+        """
+        if idle_timeout is None or idle_timeout == '':
+            return
+        idle_timeout = float(idle_timeout)
+        if not self._default_idle_timeout:
+            idle_timeout = min(self.idle_timeout, idle_timeout)
+        self.idle_timeout = idle_timeout
+        self._default_idle_timeout = False
+
+    def acquire(self, fresh=False):
+        """
+        Returns a bound connection (a new one if fresh), or None if the
+        bind failed
+        """
+        if fresh:
+            return self.factory()
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, released = self._idle.pop()
+            if now - released < self.idle_timeout:
+                return conn
+            self.discard(conn)
+        return self.factory()
+
+    def release(self, conn):
+        if conn is None:
+            return
+        with self._lock:
+            if not conn.closed and len(self._idle) < self.size:
+                self._idle.append((conn, time.time()))
+                return
+        self.discard(conn)
+
+    def forked(self):
+        """
+        Forgets the idle connections without closing them, as the parent
+        process still uses them
+        """
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def discard(self, conn):
+        if conn is None:
+            return
+        try:
+            conn.unbind()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self, fresh=False):
+        """
+        Lends a bound connection (or None) for the duration of the block
+        """
+        conn = self.acquire(fresh)
+        try:
+            yield conn
+        except Exception:
+            self.discard(conn)
+            raise
+        self.release(conn)
+
+
+class ServerHealth(object):
+    """
+    Remembers which servers could not be reached, so that connections are
+    attempted elsewhere first for the next ``retry_after`` seconds
+    """
+
+    def __init__(self, retry_after=30):
+        self.retry_after = float(retry_after)
+        self._down = {}
+        self._lock = threading.Lock()
+
+    def failed(self, url):
+        with self._lock:
+            self._down[url] = time.time() + self.retry_after
+
+    def recovered(self, url):
+        with self._lock:
+            self._down.pop(url, None)
+
+    def forked(self):
+        self._lock = threading.Lock()
+
+    def is_down(self, url):
+        return self._down.get(url, 0) > time.time()
+
+    def order(self, urls):
+        """
+        Returns the URLs with the servers known to be down last
+        """
+        return sorted(urls, key=self.is_down)
+
+    def status(self):
+        """
+        Returns the servers known to be down, with when to retry them
+        """
+        now = time.time()
+        with self._lock:
+            return dict((url, until) for url, until in self._down.items()
+                        if until > now)
+
+
+# Health of the servers, shared by all clients
+server_health = ServerHealth()
+
+
+class ServerBusyError(LDAPExceptionError):
+    """
+    Raised when an operation is refused by AdmissionControl
+    """
+
+
+def shed(environ, error):
+    """
+    Flags a request whose operation was refused by AdmissionControl, so the
+    application may answer 503 (Service Unavailable)
+    """
+    environ['who_ldap.busy'] = True
+    logging.getLogger('repoze.who').warning('Operation refused: %s', error)
+
+
+class AdmissionControl(object):
+    """
+    Limits the operations running at once against a server to
+    ``max_concurrency`` (0 for no limit), queueing up to ``max_queue`` more
+    for at most ``queue_timeout`` seconds
+
+    Queued operations are admitted by priority (lowest first), then in order
+    of arrival. Those which can't be queued or waited for too long raise a
+    ServerBusyError.
+    """
+
+    def __init__(self, name='', max_concurrency=0, max_queue=100,
+                 queue_timeout=5):
+        self.name = name
+        self.max_concurrency = int(max_concurrency)
+        self.max_queue = int(max_queue)
+        self.queue_timeout = float(queue_timeout)
+        self.running = 0
+        self._configured = set()
+        self._queue = []
+        self._arrivals = itertools.count()
+        self._cond = threading.Condition()
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self.admitted = 0
+        self.waited = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queued = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def limit(self, max_concurrency=0, max_queue=None, queue_timeout=None):
+        """
+        Applies the limits of a plugin: the smallest concurrency, with the
+        largest queue and queue timeout configured (None leaving the
+        defaults, or what other plugins configured)
+        """
+        max_concurrency = int(max_concurrency or 0)
+        with self._cond:
+            if max_concurrency > 0:
+                if self.max_concurrency > 0:
+                    max_concurrency = min(
+                        self.max_concurrency, max_concurrency)
+                self.max_concurrency = max_concurrency
+            if max_queue is not None and max_queue != '':
+                max_queue = int(max_queue)
+                if 'max_queue' in self._configured:
+                    max_queue = max(self.max_queue, max_queue)
+                self.max_queue = max_queue
+                self._configured.add('max_queue')
+            if queue_timeout is not None and queue_timeout != '':
+                queue_timeout = float(queue_timeout)
+                if 'queue_timeout' in self._configured:
+                    queue_timeout = max(self.queue_timeout, queue_timeout)
+                self.queue_timeout = queue_timeout
+                self._configured.add('queue_timeout')
+            self._cond.notify_all()
+
+    def forked(self):
+        """
+        Forgets the operations of the parent process
+        """
+        self.running = 0
+        self._queue = []
+        self._cond = threading.Condition()
+        self._reset_stats()
+
+    def acquire(self, priority=PRIORITY_METADATA):
+        """
+        Waits for the operation to be admitted
+
+        Returns whether it was counted, and must then be released.
+        """
+        if self.max_concurrency <= 0:
+            return False
+        with self._cond:
+            if self.running < self.max_concurrency and not self._queue:
+                self.running += 1
+                self.admitted += 1
+                return True
+            if len(self._queue) >= self.max_queue:
+                self.rejected += 1
+                raise ServerBusyError(
+                    'Too many operations queued for %s' % self.name)
+            entry = (int(priority), next(self._arrivals))
+            heapq.heappush(self._queue, entry)
+            self.max_queued = max(self.max_queued, len(self._queue))
+            start = time.time()
+            try:
+                while (self._queue[0] != entry or
+                       self.running >= self.max_concurrency):
+                    remaining = start + self.queue_timeout - time.time()
+                    if remaining <= 0:
+                        self.timed_out += 1
+                        raise ServerBusyError(
+                            'Timed out waiting for %s' % self.name)
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                # The next one in the queue may go now
+                self._cond.notify_all()
+            waited = time.time() - start
+            self.running += 1
+            self.admitted += 1
+            self.waited += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            return True
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority=PRIORITY_METADATA):
+        """
+        Runs the block once admitted
+        """
+        counted = self.acquire(priority)
+        try:
+            yield
+        finally:
+            if counted:
+                self.release()
+
+    def stats(self):
+        """
+        Returns the operations running and queued, with the counts of those
+        admitted (after waiting or not), rejected and timed out, and the
+        total and longest time waited, in seconds
+        """
+        with self._cond:
+            return {'running': self.running,
+                    'queued': len(self._queue),
+                    'max_queued': self.max_queued,
+                    'admitted': self.admitted,
+                    'waited': self.waited,
+                    'rejected': self.rejected,
+                    'timed_out': self.timed_out,
+                    'wait_time': self.wait_time,
+                    'max_wait_time': self.max_wait_time}
+
+
+class Operation(object):
+    """
+    An LDAP operation timed, from the start to the end of a with block,
+    on behalf of an OperationLog
+    """
+
+    def __init__(self, log, trace, operation, base_dn, filterstr=None,
+                 user_dn=False):
+        self.log = log
+        self.trace = trace
+        self.operation = operation
+        self.base_dn = base_dn
+        self.filterstr = filterstr
+        self.user_dn = user_dn
+        self.server = None
+        self.results = None
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.duration = time.time() - self.start
+        self.log.record(self)
+
+    def done(self, conn, results):
+        """
+        Notes the server which performed the operation and the number of
+        entries it returned (or whether a bind succeeded)
+        """
+        if conn is not None:
+            server = conn.server
+            self.server = '%s://%s:%s' % (
+                'ldaps' if server.ssl else 'ldap', server.host, server.port)
+        self.results = results
+
+    def as_dict(self):
+        return {'plugin': self.log.plugin,
+                'operation': self.operation,
+                'server': self.server,
+                'base_dn': (mask_dn(self.base_dn)
+                            if self.user_dn and self.base_dn
+                            else self.base_dn),
+                'filter': (normalize_filter(self.filterstr)
+                           if self.filterstr else None),
+                'results': self.results,
+                'start': self.start,
+                'duration': self.duration}
+
+
+class NullOperation(object):
+    """
+    Stands for an Operation when nothing is recorded
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def done(self, conn, results):
+        pass
+
+
+NULL_OPERATION = NullOperation()
+
+
+class OperationLog(object):
+    """
+    Logs the LDAP operations of a plugin lasting ``slow_threshold`` seconds
+    or more, and traces all those of a sample (``trace_sample``, from 0 to 1)
+    of the requests in ``environ['who_ldap.trace']``
+
+    Requests traced by another plugin are traced by this one too. Nothing is
+    timed when neither applies.
+    """
+
+    def __init__(self, plugin, slow_threshold=0, trace_sample=0):
+        self.plugin = plugin
+        self.slow_threshold = float(slow_threshold or 0)
+        self.trace_sample = float(trace_sample or 0)
+
+        assert 0 <= self.trace_sample <= 1, \
+            u'The trace sample should be between 0 and 1'
+
+    def operation(self, environ, operation, base_dn, filterstr=None,
+                  user_dn=False):
+        """
+        Returns the Operation to time with a with block, and to complete
+        with its outcome
+
+        base_dn is masked in the records if it's the DN of a user (user_dn).
+        """
+        trace = None
+        if environ is not None:
+            trace = environ.get('who_ldap.trace')
+            if self.trace_sample and 'who_ldap.trace' not in environ:
+                sampled = random.random() < self.trace_sample
+                # Decided once per request, whatever the plugin
+                trace = environ.setdefault(
+                    'who_ldap.trace', [] if sampled else None)
+        if trace is None and not self.slow_threshold:
+            return NULL_OPERATION
+        return Operation(
+            self, trace, operation, base_dn, filterstr, user_dn)
+
+    def record(self, op):
+        entry = op.as_dict()
+        if op.trace is not None:
+            op.trace.append(entry)
+        if self.slow_threshold and op.duration >= self.slow_threshold:
+            logging.getLogger('repoze.who').warning(
+                'Slow LDAP %(operation)s by %(plugin)s on %(server)s '
+                '(base DN %(base_dn)s, filter %(filter)s): '
+                '%(results)s result(s) in %(duration).3fs', entry)
+
+
+class GroupResolver(object):
+    """
+    Resolves the DNs of the groups below base_dn to the value of one of
+    their attributes, caching the results for ``ttl`` seconds
+
+    DNs whose first RDN is made of that attribute are resolved locally if
+    ``resolve_rdn`` is set, the others at once with a single paged search,
+    matching ``dn_attribute`` ('entryDN' or 'distinguishedName' depending
+    on the server). Either way, only the groups within ``search_scope`` of
+    ``base_dn`` are resolved.
+    """
+
+    def __init__(self, returned_id='cn', dn_attribute='entryDN',
+                 resolve_rdn=True, cache_size=10000, ttl=300, page_size=500,
+                 base_dn='', search_scope=SUBTREE):
+        self.returned_id = returned_id
+        self.dn_attribute = dn_attribute
+        self.resolve_rdn = resolve_rdn
+        self.ttl = float(ttl)
+        self.page_size = int(page_size)
+        self.base_dn = base_dn
+        self.search_scope = search_scope
+        self.base = dn_components(base_dn) if base_dn else []
+        self.cache = LRUCache(cache_size)
+
+    def _in_scope(self, components):
+        if self.search_scope == LEVEL:
+            return components[1:] == self.base
+        return not self.base or components[-len(self.base):] == self.base
+
+    def _from_rdn(self, dn):
+        try:
+            attribute, value, separator = parse_dn(dn, strip=True)[0]
+            components = dn_components(dn)
+        except (LDAPExceptionError, IndexError):
+            return
+        if separator == '+' or value.startswith('#') \
+                or attribute.lower() != self.returned_id.lower() \
+                or not self._in_scope(components):
+            return
+        return unescape_rdn(value)
+
+    def prime(self, dn, value):
+        """
+        Caches the value of a group found otherwise
+        """
+        self.cache.set(dn_key(dn), (value, time.time() + self.ttl))
+
+    def resolve(self, conn, dns):
+        """
+        Returns the values of the groups found for the DNs, in order
+        """
+        now = time.time()
+        values = {}
+        missing = []
+        for dn in dns:
+            key = dn_key(dn)
+            if key in values:
+                continue
+            cached = self.cache.get(key)
+            if cached is not None and cached[1] > now:
+                values[key] = cached[0]
+                continue
+            values[key] = self._from_rdn(dn) if self.resolve_rdn else None
+            if values[key] is None:
+                missing.append((key, dn))
+
+        if missing:
+            filterstr = u'(|%s)' % u''.join(
+                u'(%s=%s)' % (self.dn_attribute, escape_filter_chars(dn))
+                for key, dn in missing)
+            entries = conn.extend.standard.paged_search(
+                self.base_dn,
+                filterstr,
+                self.search_scope,
+                attributes=[self.returned_id],
+                paged_size=self.page_size,
+                generator=False)
+            found = {}
+            for entry in entries:
+                if entry.get('type') != 'searchResEntry':
+                    continue
+                value = entry['attributes'].get(self.returned_id)
+                if isinstance(value, list):
+                    value = value[0] if value else None
+                found[dn_key(entry['dn'])] = value
+            # Groups not found are cached too, as None, unless the search
+            # failed (e.g. on a size limit) and they may exist after all
+            complete = (conn.result or {}).get('description') == 'success'
+            if not complete:
+                logging.getLogger('repoze.who').error(
+                    'Cannot resolve group DNs below %s: %s',
+                    self.base_dn, conn.result)
+            for key, dn in missing:
+                values[key] = found.get(key)
+                if complete or values[key] is not None:
+                    self.cache.set(key, (values[key], now + self.ttl))
+
+        result = []
+        for dn in dns:
+            value = values.pop(dn_key(dn), None)
+            if value is not None:
+                result.append(value)
+        return result
+
+
+class ReusableTls(Tls):
+    """
+    TLS configuration of a server, which builds its SSL context once and
+    resumes the TLS session of previous connections if the server allows it
+
+    Counts the handshakes, how many of them resumed a session, and the time
+    they took. Like ldap3's own Tls, the host name is checked against the
+    certificate whenever it is validated ('optional' included).
+    """
+
+    def __init__(self, host, validate='none', ca_certs_file=None,
+                 ciphers=None):
+        validate = (validate or 'none').lower()
+
+        assert validate in TLS_VALIDATE, \
+            u'The TLS validation should be \'none\', \'optional\' or ' \
+            u'\'required\''
+
+        Tls.__init__(self,
+                     validate=TLS_VALIDATE[validate],
+                     ca_certs_file=ca_certs_file or None,
+                     ciphers=ciphers or None)
+        self.host = host
+        self.context = ssl.create_default_context(
+            ssl.Purpose.SERVER_AUTH, cafile=self.ca_certs_file)
+        self.context.check_hostname = self.validate == ssl.CERT_REQUIRED
+        self.context.verify_mode = self.validate
+        if self.ciphers:
+            self.context.set_ciphers(self.ciphers)
+        self.session = None
+        self.handshakes = 0
+        self.resumed = 0
+        self.handshake_time = 0.0
+        self._lock = threading.Lock()
+        _forkables.add(self)
+
+    def forked(self):
+        self._lock = threading.Lock()
+
+    def wrap_socket(self, connection, do_handshake=False):
+        kw = {'session': self.session} if self.session else {}
+        sock = self.context.wrap_socket(
+            connection.socket,
+            server_hostname=self.host,
+            do_handshake_on_connect=False,
+            **kw)
+        if do_handshake:
+            start = time.time()
+            sock.do_handshake()
+            elapsed = time.time() - start
+            if self.validate == ssl.CERT_OPTIONAL:
+                # Checked by the SSL context when the certificate is required
+                check_hostname(sock, self.host, self.valid_names)
+            resumed = bool(getattr(sock, 'session_reused', False))
+            with self._lock:
+                self.handshakes += 1
+                self.resumed += resumed
+                self.handshake_time += elapsed
+            logging.getLogger('repoze.who').debug(
+                'TLS handshake with %s in %.3fs (resumed: %s)',
+                self.host, elapsed, resumed)
+            self.remember(sock)
+        connection.socket = sock
+
+    def remember(self, sock):
+        """
+        Keeps the session of an SSL socket to resume it next time
+
+        TLS 1.3 sessions can only be resumed once the server sent a ticket,
+        usually along with the first response.
+        """
+        session = getattr(sock, 'session', None)
+        if session is None:
+            return
+        if session.has_ticket or sock.version() != 'TLSv1.3':
+            self.session = session
+
+    def stats(self):
+        with self._lock:
+            return {'handshakes': self.handshakes,
+                    'resumed': self.resumed,
+                    'handshake_time': self.handshake_time}
+
+
+class LDAPClient(object):
+    """
+    Connects to a directory made of one or more servers, pooling the
+    connections bound as the operating user
+
+    Plugins get their client from get_client, so that those configured with
+    the same servers, operating user and TLS settings share it.
+    """
+
+    def __init__(self, urls, bind_dn='', bind_pass='', start_tls=False,
+                 pool_size=10, tls_ca_file=None, tls_ciphers=None,
+                 tls_validate=None, admission=None):
+        urls = parse_urls(urls)
+
+        assert urls, u'Connection URL is required'
+
+        self.urls = urls
+        self.servers = {}
+        for url in urls:
+            uri = urlparse(url)
+            tls = None
+            if start_tls or uri.scheme == 'ldaps':
+                tls = get_tls(url, tls_validate, tls_ca_file, tls_ciphers)
+            self.servers[url] = make_server(url, tls)
+        self.bind_dn = bind_dn
+        self.bind_pass = bind_pass
+        self.start_tls = bool(start_tls)
+        self.pool = ConnectionPool(self._bound_connection, pool_size)
+        self.admission = admission or AdmissionControl(' '.join(urls))
+        self.warm_size = 0
+        self.resolvers = {}
+        self._lock = threading.Lock()
+
+    def group_resolver(self, returned_id, dn_attribute, resolve_rdn,
+                       cache_size, ttl, base_dn, search_scope):
+        """
+        Returns the GroupResolver shared by the plugins using this client
+        with the same returned_id, dn_attribute, resolve_rdn, base_dn and
+        search_scope (as they wouldn't find the same groups otherwise)
+        """
+        key = (returned_id.lower(), dn_attribute.lower(), resolve_rdn,
+               dn_key(base_dn), search_scope)
+        with self._lock:
+            resolver = self.resolvers.get(key)
+            if resolver is None:
+                resolver = self.resolvers[key] = GroupResolver(
+                    returned_id, dn_attribute, resolve_rdn, cache_size, ttl,
+                    base_dn=base_dn, search_scope=search_scope)
+            return resolver
+
+    def warm_up(self, count=None):
+        """
+        Resolves the names of the servers and opens connections bound as the
+        operating user until count of them (warm_size by default) are idle
+
+        Returns how many connections were opened.
+        """
+        logger = logging.getLogger('repoze.who')
+        count = self.warm_size if count is None else int(count)
+        for url in self.urls:
+            try:
+                # Cached by ldap3 for the connections to come
+                self.servers[url].address_info
+            except (socket.error, LDAPExceptionError) as e:
+                logger.warning('Cannot resolve %s: %s', url, e)
+        self.pool.size = max(self.pool.size, count)
+        conns = []
+        try:
+            for i in range(count - len(self.pool._idle)):
+                conn = self._bound_connection()
+                if conn is None:
+                    logger.error('Cannot establish connection')
+                    break
+                conns.append(conn)
+        except LDAPExceptionError as e:
+            logger.warning('Cannot warm up connections: %s', e)
+        for conn in conns:
+            self.pool.release(conn)
+        return len(conns)
+
+    def forked(self):
+        """
+        Drops the connections of the parent process
+        """
+        self._lock = threading.Lock()
+        self.pool.forked()
+
+    def warm_up_background(self):
+        """
+        Warms warm_size connections up in a background thread, if any
+        """
+        if self.warm_size:
+            thread = threading.Thread(target=self.warm_up)
+            thread.daemon = True
+            thread.start()
+
+    def open(self, user=None, password=None):
+        """
+        Returns a connection opened on the first server reachable
+        (and upgraded to TLS if required), not bound yet
+        """
+        check_fork()
+        error = None
+        for url in server_health.order(self.urls):
+            conn = Connection(self.servers[url], user, password)
+            try:
+                conn.open()
+            except LDAPCommunicationError as e:
+                logging.getLogger('repoze.who').warning(
+                    'Cannot reach %s: %s', url, e)
+                server_health.failed(url)
+                error = e
+                continue
+            server_health.recovered(url)
+            if self.start_tls:
+                conn.start_tls()
+            return conn
+        raise error
+
+    def bind(self, dn, password, priority=PRIORITY_AUTHENTICATION,
+             op=NULL_OPERATION):
+        """
+        Returns whether binding as dn with password succeeds, completing
+        the Operation op with the outcome
+        """
+        with self.admission.slot(priority):
+            conn = self.open(dn, password)
+            try:
+                bound = conn.bind()
+                self._remember_tls(conn)
+                op.done(conn, int(bool(bound)))
+                return bound
+            finally:
+                conn.unbind()
+
+    def _bound_connection(self):
+        conn = self.open(self.bind_dn, self.bind_pass)
+        if not conn.bind():
+            self.pool.discard(conn)
+            return
+        self._remember_tls(conn)
+        return conn
+
+    def _remember_tls(self, conn):
+        # The bind response came along with the TLS session ticket, if any
+        tls = conn.server.tls
+        if isinstance(tls, ReusableTls) and isinstance(
+                conn.socket, ssl.SSLSocket):
+            tls.remember(conn.socket)
+
+    def tls_stats(self):
+        """
+        Returns the TLS handshakes performed with each server by the clients
+        sharing its TLS configuration (see ReusableTls.stats)
+        """
+        return dict((url, server.tls.stats())
+                    for url, server in self.servers.items()
+                    if isinstance(server.tls, ReusableTls))
+
+    def run(self, operation, priority=PRIORITY_METADATA):
+        """
+        Returns the result of operation called with a connection bound as
+        the operating user (or None if the bind failed), once admitted
+
+        The operation is retried once over a new connection if the pooled
+        one was lost (e.g. closed by the server or by a load balancer).
+        """
+        check_fork()
+        with self.admission.slot(priority):
+            conn = self.pool.acquire()
+            try:
+                result = operation(conn)
+            except LDAPCommunicationError as e:
+                self.pool.discard(conn)
+                logging.getLogger('repoze.who').warning(
+                    'Lost connection, retrying: %s', e)
+                with self.pool.connection(fresh=True) as conn:
+                    return operation(conn)
+            except Exception:
+                self.pool.discard(conn)
+                raise
+            self.pool.release(conn)
+            return result
+
+    @contextmanager
+    def connection(self, priority=PRIORITY_METADATA):
+        """
+        Lends a connection bound as the operating user (or None if the bind
+        failed) for the duration of a with block, once admitted
+        """
+        check_fork()
+        with self.admission.slot(priority):
+            with self.pool.connection() as conn:
+                yield conn
 
 
 @implementer(IAuthenticator)
@@ -98,10 +1518,28 @@ class LDAPAuthenticatorPlugin(object):
 
     def __init__(self,
                  url,
-                 base_dn,
+                 base_dn=None,
                  start_tls=False,
                  returned_id='dn',
-                 naming_attribute='uid'
+                 naming_attribute='uid',
+                 dn_template=None,
+                 parallel_binds=False,
+                 hint_cache_size=10000,
+                 warm_up=False,
+                 max_login_failures=0,
+                 max_client_failures=0,
+                 failure_window=300,
+                 failure_backoff=1,
+                 max_failure_backoff=300,
+                 tls_ca_file=None,
+                 tls_ciphers=None,
+                 tls_validate='none',
+                 max_concurrency=0,
+                 max_queue=None,
+                 queue_timeout=None,
+                 priority=PRIORITY_AUTHENTICATION,
+                 slow_threshold=0,
+                 trace_sample=0
                  ):
         """
         Parameters:
@@ -110,41 +1548,154 @@ class LDAPAuthenticatorPlugin(object):
         start_tls -- Flag to initiate TLS upgrade on connection
         returned_id -- id to return on success ('dn' or 'login')
         naming_attribute -- naming attribute for directory entries
+        dn_template -- DN templates to try (one per line, in order of
+                       priority) instead of naming_attribute and base_dn,
+                       where {login} is replaced with the login
+        parallel_binds -- Flag to try the DN templates concurrently
+        hint_cache_size -- logins whose matching DN template is remembered
+        warm_up -- Flag (or a count) to resolve the server names at startup
+        max_login_failures -- failures of a login before throttling it
+                              (0 disables)
+        max_client_failures -- failures of a client address before
+                               throttling it (0 disables)
+        failure_window -- seconds during which failures are counted
+        failure_backoff -- initial seconds to refuse a throttled attempt
+        max_failure_backoff -- upper bound of the doubling backoff
+        tls_ca_file -- CA certificates to validate the servers with
+        tls_ciphers -- OpenSSL cipher list to allow
+        tls_validate -- Server certificate validation ('none', 'optional'
+                        or 'required')
+        max_concurrency -- operations run at once against the server
+                           (0 for no limit)
+        max_queue -- operations waiting for their turn beyond which
+                     further ones are refused (100 by default)
+        queue_timeout -- seconds an operation waits for its turn
+                         (5 by default)
+        priority -- rank of the operations of the plugin in the queue
+                    (lowest first)
+        slow_threshold -- seconds from which an operation is logged as slow
+                          (0 disables)
+        trace_sample -- share of the requests whose operations are traced
+                        in environ['who_ldap.trace'] (from 0 to 1)
         """
         returned_id = returned_id or 'dn'
         naming_attribute = naming_attribute or 'uid'
+        dn_templates = parse_list(dn_template)
 
         assert url, u'Connection URL is required'
-        assert base_dn, u'Base DN is required'
+        assert base_dn or dn_templates, u'Base DN is required'
         assert returned_id.lower() in ('dn', 'login'), \
             u'The return style should be \'dn\' or \'login\''
+        assert all(is_dn_template(t) for t in dn_templates), \
+            u'DN templates should contain \'{login}\' and no other field'
 
         self.url = url
         self.base_dn = base_dn
         self.start_tls = bool(start_tls)
+        self.client = get_client(
+            url,
+            start_tls=start_tls,
+            tls_ca_file=tls_ca_file,
+            tls_ciphers=tls_ciphers,
+            tls_validate=tls_validate,
+            max_concurrency=max_concurrency,
+            max_queue=max_queue,
+            queue_timeout=queue_timeout)
+        self.priority = int(priority)
+        self.oplog = OperationLog(
+            self.__class__.__name__, slow_threshold, trace_sample)
+        if parse_count(warm_up) > 0:
+            self.warm_up()
         self.ret_style = 'd' if returned_id.lower() == 'dn' else 'l'
         self.naming_pattern = u'%s=%%s,%%s' % naming_attribute
+        self.dn_templates = dn_templates or [u'%s={login},%s' % (
+            naming_attribute,
+            base_dn.replace('{', '{{').replace('}', '}}'))]
+        self.parallel_binds = str(parallel_binds)[0].lower() == 't'
+        self.dn_hints = LRUCache(hint_cache_size)
+        self.throttle = AuthenticationThrottle(
+            max_login_failures,
+            max_client_failures,
+            failure_window,
+            failure_backoff,
+            max_failure_backoff)
+
+    def warm_up(self):
+        """
+        Resolves the server names ahead of the requests (each user binds
+        over a connection of their own)
+        """
+        self.client.warm_up(0)
+
+    def _bind(self, environ, dn, password):
+        with self.oplog.operation(
+                environ, 'bind', dn, user_dn=True) as op:
+            return self.client.bind(dn, password, self.priority, op)
+
+    def _find(self, login, password, environ=None):
+        """
+        Returns the first DN made from the templates the user can bind as,
+        and its template
+
+        The template which matched the login last time is tried alone first.
+        """
+        templates = self.dn_templates
+        hint = self.dn_hints.get(login_key(login))
+        if hint in templates:
+            templates = [hint] + [t for t in templates if t != hint]
+        value = escape_rdn(login)
+        candidates = [(t.format(login=value), t) for t in templates]
+        if self.parallel_binds and len(candidates) > 1:
+            if hint in templates:
+                if self._bind(environ, candidates[0][0], password):
+                    return candidates[0]
+                candidates = candidates[1:]
+            executor = get_executor()
+            futures = [executor.submit(self._bind, environ, dn, password)
+                       for dn, template in candidates]
+            error = None
+            for candidate, future in zip(candidates, futures):
+                try:
+                    if future.result():
+                        return candidate
+                except LDAPExceptionError as e:
+                    # Another template may still bind
+                    error = error or e
+            if error is not None:
+                raise error
+            return None, None
+        for dn, template in candidates:
+            if self._bind(environ, dn, password):
+                return dn, template
+        return None, None
 
     # IAuthenticator
     def authenticate(self, environ, identity):
         if 'login' not in identity:
             return
-        dn = self.naming_pattern % (identity['login'], self.base_dn)
+        if not self.throttle.allows(environ, identity['login']):
+            return
         # Ensure proper encoding of unicode passwords
         password = identity['password'].encode('utf-8')
-        with make_connection(self.url, dn, password) as conn:
-            if self.start_tls:
-                conn.start_tls()
-            if not conn.bind():
-                return
-            save_userdata(identity, dn)
-            return dn if self.ret_style == 'd' else identity['login']
+        try:
+            dn, template = self._find(identity['login'], password, environ)
+        except ServerBusyError as e:
+            shed(environ, e)
+            return
+        if not dn:
+            self.throttle.failed(environ, identity['login'])
+            return
+        self.throttle.succeeded(environ, identity['login'])
+        if len(self.dn_templates) > 1:
+            self.dn_hints.set(login_key(identity['login']), template)
+        save_userdata(identity, dn)
+        return dn if self.ret_style == 'd' else identity['login']
 
 
 @implementer(IAuthenticator)
 class LDAPSearchAuthenticatorPlugin(object):
     """
-    Authenticates the user by performing a search from a base DN
+    Authenticates the user by performing a search from one or more base DNs
     """
 
     def __init__(self,
@@ -156,12 +1707,31 @@ class LDAPSearchAuthenticatorPlugin(object):
                  returned_id='dn',
                  naming_attribute='uid',
                  search_scope='subtree',
-                 restrict=''
+                 restrict='',
+                 pool_size=10,
+                 warm_up=0,
+                 hint_cache_size=10000,
+                 max_login_failures=0,
+                 max_client_failures=0,
+                 failure_window=300,
+                 failure_backoff=1,
+                 max_failure_backoff=300,
+                 tls_ca_file=None,
+                 tls_ciphers=None,
+                 tls_validate='none',
+                 max_concurrency=0,
+                 max_queue=None,
+                 queue_timeout=None,
+                 priority=PRIORITY_AUTHENTICATION,
+                 slow_threshold=0,
+                 trace_sample=0,
+                 idle_timeout=None
                  ):
         """
         Parameters:
         url -- LDAP URL
-        base_dn -- Base node to search
+        base_dn -- Base node to search, or several ones (one per line) in
+                   order of priority
         bind_dn -- User for querying the LDAP database
         bind_pass -- User password
         start_tls -- Flag to initiate TLS upgrade on connection
@@ -169,20 +1739,51 @@ class LDAPSearchAuthenticatorPlugin(object):
         naming_attribute -- naming attribute for directory entries
         search_scope -- Scope of search ('onelevel' or 'subtree')
         restrict -- Additional search criterion ANDed to search string.
+        pool_size -- idle connections kept for searching
+        warm_up -- connections to open at startup (and after a fork),
+                   true standing for 1
+        hint_cache_size -- logins whose matching base DN is remembered
+        max_login_failures -- failures of a login before throttling it
+                              (0 disables)
+        max_client_failures -- failures of a client address before
+                               throttling it (0 disables)
+        failure_window -- seconds during which failures are counted
+        failure_backoff -- initial seconds to refuse a throttled attempt
+        max_failure_backoff -- upper bound of the doubling backoff
+        tls_ca_file -- CA certificates to validate the servers with
+        tls_ciphers -- OpenSSL cipher list to allow
+        tls_validate -- Server certificate validation ('none', 'optional'
+                        or 'required')
+        max_concurrency -- operations run at once against the server
+                           (0 for no limit)
+        max_queue -- operations waiting for their turn beyond which
+                     further ones are refused (100 by default)
+        queue_timeout -- seconds an operation waits for its turn
+                         (5 by default)
+        priority -- rank of the operations of the plugin in the queue
+                    (lowest first)
+        slow_threshold -- seconds from which an operation is logged as slow
+                          (0 disables)
+        trace_sample -- share of the requests whose operations are traced
+                        in environ['who_ldap.trace'] (from 0 to 1)
+        idle_timeout -- seconds after which an idle connection is dropped
+                        rather than reused (60 by default)
         """
         returned_id = returned_id or 'dn'
         naming_attribute = naming_attribute or 'uid'
         search_scope = search_scope or 'subtree'
+        base_dns = parse_list(base_dn)
 
         assert url, u'Connection URL is required'
-        assert base_dn, u'Base DN is required'
+        assert base_dns, u'Base DN is required'
         assert returned_id.lower() in ('dn', 'login'), \
             u'The return style should be \'dn\' or \'login\''
         assert search_scope.lower()[:3] in ('one', 'sub'), \
             u'The search scope should be \'one[level]\' or \'sub[tree]\')'
 
         self.url = url
-        self.base_dn = base_dn
+        self.base_dns = base_dns
+        self.base_dn = base_dns[0]
         self.bind_dn = bind_dn
         self.bind_pass = bind_pass
         self.start_tls = bool(start_tls)
@@ -197,6 +1798,84 @@ class LDAPSearchAuthenticatorPlugin(object):
                 restrict, naming_attribute)
         else:
             self.search_pattern = u'(%s=%%s)' % naming_attribute
+        self.client = get_client(
+            url, bind_dn, bind_pass, start_tls, pool_size,
+            tls_ca_file, tls_ciphers, tls_validate,
+            max_concurrency, max_queue, queue_timeout, idle_timeout)
+        self.priority = int(priority)
+        self.oplog = OperationLog(
+            self.__class__.__name__, slow_threshold, trace_sample)
+        warm_up = parse_count(warm_up)
+        self.client.warm_size = max(self.client.warm_size, warm_up)
+        if warm_up > 0:
+            self.warm_up()
+        self.base_hints = LRUCache(hint_cache_size)
+        self.throttle = AuthenticationThrottle(
+            max_login_failures,
+            max_client_failures,
+            failure_window,
+            failure_backoff,
+            max_failure_backoff)
+
+    def warm_up(self, count=None):
+        """
+        Opens connections ahead of the requests, see LDAPClient.warm_up
+        """
+        return self.client.warm_up(count)
+
+    def _search(self, base_dn, search, environ=None):
+        """
+        Returns the DNs of the entries matching below base_dn,
+        or None if the search could not be performed
+        """
+        def search_below(conn):
+            if conn is None:
+                logging.getLogger('repoze.who').error(
+                    'Cannot establish connection')
+                return
+            with self.oplog.operation(
+                    environ, 'search', base_dn, search) as op:
+                conn.search(base_dn, search, self.search_scope)
+                found = [r['dn'] for r in conn.response or ()
+                         if r.get('type') == 'searchResEntry']
+                op.done(conn, len(found))
+            # A missing base DN holds no entry, other errors tell nothing
+            if (conn.result or {}).get('description') not in (
+                    'success', 'noSuchObject'):
+                logging.getLogger('repoze.who').error(
+                    'Cannot search %s for %s: %s', base_dn, search,
+                    conn.result)
+                return
+            return found
+
+        return self.client.run(search_below, self.priority)
+
+    def _find(self, login, search, environ=None):
+        """
+        Returns the base DN searched and the DNs found below it
+
+        Base DNs are searched concurrently, the first one with matches (in
+        order of priority) wins. The base DN where the login was last found
+        is tried alone beforehand.
+        """
+        base_dns = self.base_dns
+        hint = self.base_hints.get(login_key(login))
+        if hint in base_dns:
+            found = self._search(hint, search, environ)
+            if found is None or found:
+                return hint, found
+            base_dns = [b for b in base_dns if b != hint]
+        if len(base_dns) == 1:
+            return base_dns[0], self._search(base_dns[0], search, environ)
+        executor = get_executor()
+        futures = [executor.submit(self._search, b, search, environ)
+                   for b in base_dns]
+        for base_dn, future in zip(base_dns, futures):
+            found = future.result()
+            # Don't fall through to a lower priority if this one is unknown
+            if found is None or found:
+                return base_dn, found
+        return None, []
 
     # IAuthenticator
     def authenticate(self, environ, identity):
@@ -204,35 +1883,47 @@ class LDAPSearchAuthenticatorPlugin(object):
 
         if 'login' not in identity:
             return
+        if not self.throttle.allows(environ, identity['login']):
+            return
 
-        with make_connection(self.url, self.bind_dn, self.bind_pass) as conn:
-            if self.start_tls:
-                conn.start_tls()
-
-            if not conn.bind():
-                logger.error('Cannot establish connection')
-                return
-
-            escaped_login = escape_filter_chars(identity['login'])
-            search = \
-                self.search_pattern % escaped_login
-            conn.search(self.base_dn, search, self.search_scope)
+        escaped_login = escape_filter_chars(identity['login'])
+        search = \
+            self.search_pattern % escaped_login
+        try:
+            base_dn, found = self._find(identity['login'], search, environ)
+        except ServerBusyError as e:
+            shed(environ, e)
+            return
 
-            if len(conn.response) > 1:
-                logger.error('Too many entries found for %s', search)
-                return
-            if len(conn.response) < 1:
-                logger.warn('No entry found for %s', search)
-                return
+        if found is None:
+            return
+        if len(found) > 1:
+            logger.error('Too many entries found for %s', search)
+            self.throttle.failed(environ, identity['login'])
+            return
+        if len(found) < 1:
+            logger.warn('No entry found for %s', search)
+            self.throttle.failed(environ, identity['login'])
+            return
 
-            dn = conn.response[0]['dn']
-            # Ensure proper encoding of unicode passwords
-            password = identity['password'].encode('utf-8')
-            with make_connection(self.url, dn, password) as check:
-                if not check.bind():
-                    return
-                save_userdata(identity, dn)
-                return dn if self.ret_style == 'd' else identity['login']
+        dn = found[0]
+        # Ensure proper encoding of unicode passwords
+        password = identity['password'].encode('utf-8')
+        try:
+            with self.oplog.operation(
+                    environ, 'bind', dn, user_dn=True) as op:
+                bound = self.client.bind(dn, password, self.priority, op)
+        except ServerBusyError as e:
+            shed(environ, e)
+            return
+        if not bound:
+            self.throttle.failed(environ, identity['login'])
+            return
+        self.throttle.succeeded(environ, identity['login'])
+        if len(self.base_dns) > 1:
+            self.base_hints.set(login_key(identity['login']), base_dn)
+        save_userdata(identity, dn)
+        return dn if self.ret_style == 'd' else identity['login']
 
 
 @implementer(IMetadataProvider)
@@ -249,7 +1940,19 @@ class LDAPAttributesPlugin(object):
                  filterstr='',
                  name=None,
                  attributes=None,
-                 flatten=False):
+                 flatten=False,
+                 pool_size=10,
+                 warm_up=0,
+                 tls_ca_file=None,
+                 tls_ciphers=None,
+                 tls_validate='none',
+                 max_concurrency=0,
+                 max_queue=None,
+                 queue_timeout=None,
+                 priority=PRIORITY_METADATA,
+                 slow_threshold=0,
+                 trace_sample=0,
+                 idle_timeout=None):
         """
         Parameters:
         url -- LDAP URL
@@ -266,6 +1969,27 @@ class LDAPAttributesPlugin(object):
                       attribute names to the desired alias)
         flatten -- If values contain a single item,
                    they will be converted to a scalar
+        pool_size -- idle connections kept for searching
+        warm_up -- connections to open at startup (and after a fork),
+                   true standing for 1
+        tls_ca_file -- CA certificates to validate the servers with
+        tls_ciphers -- OpenSSL cipher list to allow
+        tls_validate -- Server certificate validation ('none', 'optional'
+                        or 'required')
+        max_concurrency -- operations run at once against the server
+                           (0 for no limit)
+        max_queue -- operations waiting for their turn beyond which
+                     further ones are refused (100 by default)
+        queue_timeout -- seconds an operation waits for its turn
+                         (5 by default)
+        priority -- rank of the operations of the plugin in the queue
+                    (lowest first)
+        slow_threshold -- seconds from which an operation is logged as slow
+                          (0 disables)
+        trace_sample -- share of the requests whose operations are traced
+                        in environ['who_ldap.trace'] (from 0 to 1)
+        idle_timeout -- seconds after which an idle connection is dropped
+                        rather than reused (60 by default)
         """
         attributes_map = parse_map(attributes)
 
@@ -275,44 +1999,67 @@ class LDAPAttributesPlugin(object):
         self.bind_dn = bind_dn
         self.bind_pass = bind_pass
         self.start_tls = bool(start_tls)
+        self.client = get_client(
+            url, bind_dn, bind_pass, start_tls, pool_size,
+            tls_ca_file, tls_ciphers, tls_validate,
+            max_concurrency, max_queue, queue_timeout, idle_timeout)
+        self.priority = int(priority)
+        self.oplog = OperationLog(
+            self.__class__.__name__, slow_threshold, trace_sample)
+        warm_up = parse_count(warm_up)
+        self.client.warm_size = max(self.client.warm_size, warm_up)
+        if warm_up > 0:
+            self.warm_up()
 
         self.name = name
         self.attributes = \
             list(attributes_map.keys()) if attributes_map else ALL_ATTRIBUTES
         self._attributes_map = attributes_map
         self.filterstr = filterstr
+        self.filter = FilterTemplate(filterstr) if filterstr else None
         self.flatten = str(flatten)[0].lower() == 't'
 
+    def warm_up(self, count=None):
+        """
+        Opens connections ahead of the requests, see LDAPClient.warm_up
+        """
+        return self.client.warm_up(count)
+
     # IMetadataProvider
     def add_metadata(self, environ, identity):
         logger = logging.getLogger('repoze.who')
 
-        with make_connection(self.url, self.bind_dn, self.bind_pass) as conn:
-            if self.start_tls:
-                conn.start_tls()
-            if not conn.bind():
+        def add(conn):
+            if conn is None:
                 logger.error('Cannot establish connection')
                 return
 
             # Behave like search if filterstr is specified, otherwise use base
-            if self.filterstr:
+            if self.filter:
                 search_scope = SUBTREE
-                filterstr = self.filterstr.format(identity=identity)
+                filterstr = self.filter.render(identity)
+                if filterstr is None:
+                    logger.error('Missing identity fields for %s',
+                                 self.filterstr)
+                    return
                 # XXX This might need to be a setting?
                 base_dn = ''
             else:
                 search_scope = BASE
                 filterstr = '(objectClass=*)'   # ldap requires a filter string
-                base_dn = extract_userdata(identity)
+                base_dn = extract_userdata(identity, environ)
                 if not base_dn:
                     logger.error('Malformed userdata')
                     return
 
-            status = conn.search(
-                base_dn,
-                filterstr,
-                search_scope,
-                attributes=self.attributes)
+            with self.oplog.operation(environ, 'search', base_dn, filterstr,
+                                      user_dn=search_scope == BASE) as op:
+                status = conn.search(
+                    base_dn,
+                    filterstr,
+                    search_scope,
+                    attributes=self.attributes)
+                op.done(conn, len(conn.response or ()))
 
             if not status:
                 logger.error(
@@ -332,6 +2079,11 @@ class LDAPAttributesPlugin(object):
 
             identity.update(result if not self.name else {self.name: result})
 
+        try:
+            self.client.run(add, self.priority)
+        except ServerBusyError as e:
+            shed(environ, e)
+
 
 @implementer(IMetadataProvider)
 class LDAPGroupsPlugin(object):
@@ -348,7 +2100,24 @@ class LDAPGroupsPlugin(object):
                  filterstr='',
                  name=None,
                  search_scope='subtree',
-                 returned_id='cn'):
+                 returned_id='cn',
+                 pool_size=10,
+                 warm_up=0,
+                 tls_ca_file=None,
+                 tls_ciphers=None,
+                 tls_validate='none',
+                 member_attribute=None,
+                 dn_attribute='entryDN',
+                 resolve_rdn=True,
+                 group_cache_size=10000,
+                 group_cache_ttl=300,
+                 max_concurrency=0,
+                 max_queue=None,
+                 queue_timeout=None,
+                 priority=PRIORITY_METADATA,
+                 slow_threshold=0,
+                 trace_sample=0,
+                 idle_timeout=None):
         """
         Parameters:
         url -- LDAP URL
@@ -363,6 +2132,36 @@ class LDAPGroupsPlugin(object):
                 will specify the identity itself.
         search_scope  -- [sub]tree or [one]level of search
         returned_id -- naming attribute or group directory entries
+        pool_size -- idle connections kept for searching
+        warm_up -- connections to open at startup (and after a fork),
+                   true standing for 1
+        tls_ca_file -- CA certificates to validate the servers with
+        tls_ciphers -- OpenSSL cipher list to allow
+        tls_validate -- Server certificate validation ('none', 'optional'
+                        or 'required')
+        member_attribute -- attribute of the user entry listing the DNs of
+                            its groups (e.g. memberOf), to use instead of
+                            searching with filterstr
+        dn_attribute -- attribute to search groups by DN with
+                        ('entryDN' or 'distinguishedName')
+        resolve_rdn -- Flag to take the group names from their DNs when
+                       named after returned_id
+        group_cache_size -- group DNs whose name is remembered
+        group_cache_ttl -- seconds to remember the name of a group DN
+        max_concurrency -- operations run at once against the server
+                           (0 for no limit)
+        max_queue -- operations waiting for their turn beyond which
+                     further ones are refused (100 by default)
+        queue_timeout -- seconds an operation waits for its turn
+                         (5 by default)
+        priority -- rank of the operations of the plugin in the queue
+                    (lowest first)
+        slow_threshold -- seconds from which an operation is logged as slow
+                          (0 disables)
+        trace_sample -- share of the requests whose operations are traced
+                        in environ['who_ldap.trace'] (from 0 to 1)
+        idle_timeout -- seconds after which an idle connection is dropped
+                        rather than reused (60 by default)
 
         """
         returned_id = returned_id or 'cn'
@@ -378,6 +2177,17 @@ class LDAPGroupsPlugin(object):
         self.bind_dn = bind_dn
         self.bind_pass = bind_pass
         self.start_tls = bool(start_tls)
+        self.client = get_client(
+            url, bind_dn, bind_pass, start_tls, pool_size,
+            tls_ca_file, tls_ciphers, tls_validate,
+            max_concurrency, max_queue, queue_timeout, idle_timeout)
+        self.priority = int(priority)
+        self.oplog = OperationLog(
+            self.__class__.__name__, slow_threshold, trace_sample)
+        warm_up = parse_count(warm_up)
+        self.client.warm_size = max(self.client.warm_size, warm_up)
+        if warm_up > 0:
+            self.warm_up()
         self.search_scope = \
             SUBTREE \
             if search_scope.lower().startswith('sub') \
@@ -386,29 +2196,56 @@ class LDAPGroupsPlugin(object):
         self.name = name
         self.filterstr = filterstr or (
             '(&(objectClass=groupOfUniqueNames)(uniqueMember=%(dn)s))')
+        self.filter = FilterTemplate(self.filterstr, '%', fields=('dn',))
         self.returned_id = returned_id
+        self.member_attribute = member_attribute
+        self.resolver = self.client.group_resolver(
+            returned_id,
+            dn_attribute or 'entryDN',
+            str(resolve_rdn)[0].lower() == 't',
+            group_cache_size,
+            group_cache_ttl,
+            base_dn,
+            self.search_scope)
+
+    def warm_up(self, count=None):
+        """
+        Opens connections ahead of the requests, see LDAPClient.warm_up
+        """
+        return self.client.warm_up(count)
 
     # IMetadataProvider
     def add_metadata(self, environ, identity):
         logger = logging.getLogger('repoze.who')
 
-        with make_connection(self.url, self.bind_dn, self.bind_pass) as conn:
-            if self.start_tls:
-                conn.start_tls()
-            if not conn.bind():
+        def add(conn):
+            if conn is None:
                 logger.error('Cannot establish connection')
                 return
 
-            dn = extract_userdata(identity)
+            dn = extract_userdata(identity, environ)
 
             if not dn:
                 logger.error('Malformed userdata')
                 return
 
-            status = conn.search(self.base_dn,
-                                 self.filterstr % {'dn': dn},
-                                 self.search_scope,
-                                 attributes=[self.returned_id])
+            if self.member_attribute:
+                base_dn, filterstr = dn, '(objectClass=*)'
+                search_scope = BASE
+                attributes = [self.member_attribute]
+            else:
+                base_dn = self.base_dn
+                filterstr = self.filter.render({'dn': dn})
+                search_scope = self.search_scope
+                attributes = [self.returned_id]
+
+            with self.oplog.operation(environ, 'search', base_dn, filterstr,
+                                      user_dn=search_scope == BASE) as op:
+                status = conn.search(base_dn,
+                                     filterstr,
+                                     search_scope,
+                                     attributes=attributes)
+                op.done(conn, len(conn.response or ()))
 
             if not status:
                 logger.error(
@@ -417,7 +2254,23 @@ class LDAPGroupsPlugin(object):
                     conn.result)
                 return
 
-            groups = tuple(r['attributes'][self.returned_id][0]
-                           for r in conn.response)
+            if self.member_attribute:
+                group_dns = conn.response[0]['attributes'].get(
+                    self.member_attribute) or []
+                with self.oplog.operation(
+                        environ, 'resolve', self.base_dn) as op:
+                    groups = tuple(
+                        self.resolver.resolve(conn, group_dns))
+                    op.done(conn, len(groups))
+            else:
+                groups = tuple(r['attributes'][self.returned_id][0]
+                               for r in conn.response)
+                for r, group in zip(conn.response, groups):
+                    self.resolver.prime(r['dn'], group)
 
             identity[self.name] = groups
+
+        try:
+            self.client.run(add, self.priority)
+        except ServerBusyError as e:
+            shed(environ, e)
@@ -18,6 +18,7 @@ Test suite for who_ldap
 Uses an actual connection, and attempts to create the testing items
 """
 
+import os
 import unittest
 
 BIND_HOST = 'localhost'
@@ -104,6 +105,30 @@ class Base(unittest.TestCase):
         return environ
 
 
+class StubConnection(object):
+    """Stands for a bound connection, answering searches with a result"""
+
+    closed = False
+
+    def __init__(self, description='success', response=None):
+        self.result = {'description': description}
+        self.response = response or []
+        self.searches = []
+        # For conn.extend.standard.paged_search
+        self.extend = self.standard = self
+
+    def search(self, *args, **kw):
+        self.searches.append(args)
+        return self.result['description'] == 'success'
+
+    def paged_search(self, *args, **kw):
+        self.search(*args, **kw)
+        return self.response
+
+    def unbind(self):
+        self.closed = True
+
+
 class TestMakeLDAPAuthenticatorPlugin(unittest.TestCase):
     """Tests for the constructor of the L{LDAPAuthenticatorPlugin} plugin"""
 
@@ -114,9 +139,16 @@ class TestMakeLDAPAuthenticatorPlugin(unittest.TestCase):
 
     def test_without_BASE_DN(self):
         from who_ldap import LDAPAuthenticatorPlugin
-        self.assertRaises(TypeError, LDAPAuthenticatorPlugin, BIND_URI)
+        self.assertRaises(AssertionError, LDAPAuthenticatorPlugin, BIND_URI)
         self.assertRaises(ValueError, LDAPAuthenticatorPlugin, BIND_URI, None)
 
+    def test_dn_template_without_BASE_DN(self):
+        from who_ldap import LDAPAuthenticatorPlugin
+        plugin = LDAPAuthenticatorPlugin(
+            BIND_URI, dn_template='uid={login},%s' % BASE_DN)
+        self.assertEqual(plugin.dn_templates,
+                         ['uid={login},%s' % BASE_DN])
+
     def test_connection_is_url(self):
         from who_ldap import LDAPAuthenticatorPlugin
         LDAPAuthenticatorPlugin('ldap://example.org', 'dc=example,dc=org')
@@ -202,6 +234,86 @@ class TestLDAPAuthenticatorPlugin(Base):
         self.assertTrue(plugin.called)
 
 
+class TestLDAPAuthenticatorPluginTemplates(Base):
+    """
+    Tests the L{LDAPAuthenticatorPlugin} IAuthenticator plugin with several
+    DN templates
+    """
+
+    def makePlugin(self, **kw):
+        from who_ldap import LDAPAuthenticatorPlugin
+        kw.setdefault('dn_template', 'cn={login},%s\nuid={login},%s' % (
+            BASE_DN, BASE_DN))
+        return LDAPAuthenticatorPlugin(BIND_URI, **kw)
+
+    def test_authenticate_comparefail(self):
+        plugin = self.makePlugin()
+        env = self.makeEnviron()
+        identity = {'login': fakeuser['uid'],
+                    'password': 'wrong password'}
+        result = plugin.authenticate(env, identity)
+        self.assertIsNone(result)
+
+    def test_authenticate_comparesuccess(self):
+        plugin = self.makePlugin()
+        env = self.makeEnviron()
+        identity = {'login': fakeuser['uid'],
+                    'password': fakeuser['password']}
+        result = plugin.authenticate(env, identity)
+        self.assertEqual(result, fakeuser['dn'])
+        self.assertEqual(plugin.dn_hints.get(fakeuser['uid']),
+                         'uid={login},%s' % BASE_DN)
+
+    def test_authenticate_parallel(self):
+        plugin = self.makePlugin(parallel_binds=True)
+        env = self.makeEnviron()
+        identity = {'login': fakeuser['uid'],
+                    'password': fakeuser['password']}
+        result = plugin.authenticate(env, identity)
+        self.assertEqual(result, fakeuser['dn'])
+
+    def test_parallel_error(self):
+        from ldap3.core.exceptions import LDAPSocketOpenError
+        plugin = self.makePlugin(parallel_binds=True)
+
+        class Client(object):
+            def bind(self, dn, password, priority, op):
+                if dn.startswith('cn='):
+                    raise LDAPSocketOpenError('unreachable')
+                return dn == fakeuser['dn']
+
+        plugin.client = Client()
+        self.assertEqual(plugin._find(fakeuser['uid'], 'password'),
+                         (fakeuser['dn'], 'uid={login},%s' % BASE_DN))
+        self.assertRaises(LDAPSocketOpenError, plugin._find, 'nobody', 'pw')
+
+    def test_hint_login_case(self):
+        plugin = self.makePlugin()
+        bound = []
+
+        class Client(object):
+            def bind(self, dn, password, priority, op):
+                bound.append(dn)
+                return dn.startswith('uid=')
+
+        plugin.client = Client()
+        env = self.makeEnviron()
+        for login in ('Carla', ' carla ', 'CARLA'):
+            identity = {'login': login, 'password': fakeuser['password']}
+            self.assertTrue(plugin.authenticate(env, identity))
+        # Bound with the second template, then tried it first whatever the
+        # case
+        self.assertEqual([dn.split('=')[0] for dn in bound],
+                         ['cn', 'uid', 'uid', 'uid'])
+        self.assertEqual(len(plugin.dn_hints), 1)
+
+    def test_invalid_templates(self):
+        for template in ('cn={login},{base}', 'cn={login!r},%s' % BASE_DN,
+                         'cn={login},{', 'cn={0}'):
+            self.assertRaises(AssertionError, self.makePlugin,
+                              dn_template=template)
+
+
 class TestLDAPSearchAuthenticatorPluginNaming(Base):
     """Tests for the L{LDAPSearchAuthenticatorPlugin} IAuthenticator plugin"""
 
@@ -238,6 +350,92 @@ class TestLDAPSearchAuthenticatorPluginNaming(Base):
         self.assertEqual(result, fakeuser['dn'])
 
 
+class TestLDAPSearchAuthenticatorPluginBaseDNs(Base):
+    """
+    Tests the L{LDAPSearchAuthenticatorPlugin} IAuthenticator plugin searching
+    several base DNs
+    """
+
+    def makePlugin(self):
+        from who_ldap import LDAPSearchAuthenticatorPlugin
+        return LDAPSearchAuthenticatorPlugin(
+            BIND_URI,
+            'ou=partners,%s\n%s' % (DOMAIN_DN, BASE_DN),
+            BIND_DN,
+            BIND_PW)
+
+    def test_base_dns(self):
+        plugin = self.makePlugin()
+        self.assertEqual(plugin.base_dns,
+                         ['ou=partners,%s' % DOMAIN_DN, BASE_DN])
+
+    def test_authenticate_noresults(self):
+        plugin = self.makePlugin()
+        env = self.makeEnviron()
+        identity = {'login': 'i_dont_exist',
+                    'password': 'super secure password'}
+        result = plugin.authenticate(env, identity)
+        self.assertIsNone(result)
+
+    def test_authenticate_comparesuccess(self):
+        plugin = self.makePlugin()
+        env = self.makeEnviron()
+        identity = {'login': fakeuser['uid'],
+                    'password': fakeuser['password']}
+        result = plugin.authenticate(env, identity)
+        self.assertEqual(result, fakeuser['dn'])
+        self.assertEqual(plugin.base_hints.get(fakeuser['uid']), BASE_DN)
+        result = plugin.authenticate(env, identity)
+        self.assertEqual(result, fakeuser['dn'])
+
+    def test_search_failed(self):
+        from who_ldap import ConnectionPool, LDAPSearchAuthenticatorPlugin
+        plugin = LDAPSearchAuthenticatorPlugin(
+            'ldap://busy.example.org',
+            'ou=partners,%s\n%s' % (DOMAIN_DN, BASE_DN),
+            max_login_failures=1)
+        conns = []
+
+        def busy():
+            conns.append(StubConnection('busy'))
+            return conns[-1]
+
+        plugin.client.pool = ConnectionPool(busy, 0)
+        env = self.makeEnviron()
+        identity = {'login': fakeuser['uid'],
+                    'password': fakeuser['password']}
+        self.assertEqual(plugin._find(fakeuser['uid'], '(uid=carla)'),
+                         ('ou=partners,%s' % DOMAIN_DN, None))
+        self.assertIsNone(plugin.authenticate(env, identity))
+        self.assertTrue(plugin.throttle.allows(env, fakeuser['uid']))
+
+    def test_hint_login_case(self):
+        from who_ldap import LDAPSearchAuthenticatorPlugin
+        plugin = LDAPSearchAuthenticatorPlugin(
+            'ldap://hints.example.org',
+            'ou=partners,%s\n%s' % (DOMAIN_DN, BASE_DN))
+        searched = []
+
+        def search(base_dn, search, environ=None):
+            searched.append(base_dn)
+            return [fakeuser['dn']] if base_dn == BASE_DN else []
+
+        class Client(object):
+            def bind(self, dn, password, priority, op):
+                return True
+
+        plugin._search = search
+        plugin.client = Client()
+        env = self.makeEnviron()
+        for login in ('Carla', ' carla ', 'CARLA'):
+            identity = {'login': login, 'password': fakeuser['password']}
+            self.assertEqual(plugin.authenticate(env, identity),
+                             fakeuser['dn'])
+        # Found below BASE_DN, then looked for there first whatever the case
+        self.assertEqual(searched[2:], [BASE_DN, BASE_DN])
+        self.assertEqual(len(plugin.base_hints), 1)
+
+
 class TestLDAPAuthenticatorReturnLogin(Base):
     """
     Tests the L{LDAPAuthenticatorPlugin} IAuthenticator plugin returning
@@ -338,6 +536,401 @@ class TestLDAPSearchAuthenticatorReturnLogin(Base):
         self.assertEqual(identity['userdata'], expected_dn)
 
 
+class TestUserdata(unittest.TestCase):
+
+    def test_dict(self):
+        from who_ldap import extract_userdata, save_userdata
+        identity = {}
+        save_userdata(identity, fakeuser['dn'])
+        self.assertEqual(identity['userdata'], {'dn': fakeuser['dn']})
+        self.assertEqual(extract_userdata(identity), fakeuser['dn'])
+
+    def test_string(self):
+        from who_ldap import extract_userdata, save_userdata
+        identity = {'userdata': 'other data'}
+        save_userdata(identity, 'uid=old,%s' % BASE_DN)
+        save_userdata(identity, fakeuser['dn'])
+        self.assertEqual(identity['userdata'].count('<dn:'), 1)
+        self.assertTrue(identity['userdata'].startswith('other data'))
+        self.assertEqual(extract_userdata(identity), fakeuser['dn'])
+
+    def test_memoized(self):
+        from who_ldap import extract_userdata, save_userdata
+        environ = {}
+        identity = {'userdata': ''}
+        save_userdata(identity, fakeuser['dn'])
+        self.assertEqual(extract_userdata(identity, environ), fakeuser['dn'])
+        self.assertEqual(environ['who_ldap.userdata'][0],
+                         identity['userdata'])
+        save_userdata(identity, 'uid=other,%s' % BASE_DN)
+        self.assertEqual(extract_userdata(identity, environ),
+                         'uid=other,%s' % BASE_DN)
+
+    def test_invalid(self):
+        from who_ldap import extract_userdata
+        for userdata in (None, '', 'no dn', '<dn:', '<dn:%%%>', '<dn:/w==>'):
+            self.assertIsNone(extract_userdata({'userdata': userdata}))
+
+
+class TestGetClient(unittest.TestCase):
+    """Tests for the L{LDAPClient} registry shared by the plugins"""
+
+    def test_shared(self):
+        from who_ldap import LDAPSearchAuthenticatorPlugin
+        from who_ldap import LDAPGroupsPlugin
+        url = 'ldap://shared.example.org'
+        auth = LDAPSearchAuthenticatorPlugin(
+            url, BASE_DN, BIND_DN, BIND_PW, pool_size=2)
+        groups = LDAPGroupsPlugin(
+            url, BASE_DN, BIND_DN, BIND_PW, pool_size=5)
+        self.assertIs(auth.client, groups.client)
+        self.assertEqual(auth.client.pool.size, 5)
+
+    def test_not_shared(self):
+        from who_ldap import get_client
+        self.assertIsNot(get_client(BIND_URI, BIND_DN, BIND_PW),
+                         get_client(BIND_URI, BIND_DN, BIND_PW, True))
+        self.assertIsNot(get_client(BIND_URI, BIND_DN, BIND_PW),
+                         get_client(BIND_URI))
+
+    def test_retry(self):
+        from ldap3.core.exceptions import LDAPSocketReceiveError
+        from who_ldap import ConnectionPool, get_client
+        client = get_client('ldap://retry.example.org')
+        lost, fresh = StubConnection(), StubConnection()
+
+        def search(conn):
+            if conn is lost:
+                raise LDAPSocketReceiveError('connection reset')
+            return conn
+
+        client.pool = ConnectionPool(lambda: fresh, 1)
+        client.pool.release(lost)
+        self.assertIs(client.run(search), fresh)
+        self.assertTrue(lost.closed)
+        self.assertEqual([c for c, t in client.pool._idle], [fresh])
+
+    def test_idle_timeout(self):
+        from who_ldap import get_client
+        url = 'ldap://idle.example.org'
+        client = get_client(url)
+        self.assertEqual(client.pool.idle_timeout, 60)
+        get_client(url, idle_timeout='300')
+        get_client(url)
+        self.assertEqual(client.pool.idle_timeout, 300)
+        get_client(url, idle_timeout=30)
+        self.assertEqual(client.pool.idle_timeout, 30)
+
+    def test_several_servers(self):
+        from who_ldap import get_client
+        client = get_client('ldap://ldap1.example.org ldap://ldap2')
+        self.assertEqual(client.urls,
+                         ['ldap://ldap1.example.org', 'ldap://ldap2'])
+
+    def test_tls(self):
+        import ssl
+        from who_ldap import get_client
+        url = 'ldaps://tls.example.org'
+        client = get_client(url, tls_validate='required')
+        self.assertIsNot(client, get_client(url))
+        tls = client.servers[url].tls
+        self.assertEqual(tls.context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertTrue(tls.context.check_hostname)
+        self.assertEqual(client.tls_stats()[url]['handshakes'], 0)
+        # Resuming the sessions of the clients with other operating users
+        other = get_client(url, 'cn=other', tls_validate='Required')
+        self.assertIs(other.servers[url].tls, tls)
+        self.assertIsNot(get_client(url).servers[url].tls, tls)
+
+    def test_tls_resumed(self):
+        import shutil
+        import socket
+        import ssl
+        import subprocess
+        import tempfile
+        import threading
+        from ldap3.core.exceptions import LDAPCertificateError
+        from who_ldap import ReusableTls
+        if not hasattr(ssl, 'TLSVersion'):
+            self.skipTest('Python 3.7+ is required to pick the TLS version')
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        cert = os.path.join(tmp, 'cert.pem')
+        try:
+            subprocess.check_call(
+                ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+                 '-subj', '/CN=localhost', '-days', '1',
+                 '-keyout', cert, '-out', cert],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except (OSError, subprocess.CalledProcessError):
+            self.skipTest('openssl is required to make a certificate')
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert)
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        self.addCleanup(listener.close)
+
+        def serve(count=3):
+            for i in range(count):
+                try:
+                    sock = context.wrap_socket(listener.accept()[0],
+                                               server_side=True)
+                    # Sends the TLS 1.3 session ticket along
+                    sock.sendall(b'x')
+                    sock.recv(1)
+                    sock.close()
+                except (ssl.SSLError, socket.error):
+                    pass
+
+        class Connection(object):
+            pass
+
+        for version, name in ((ssl.TLSVersion.TLSv1_2, 'TLSv1.2'),
+                              (ssl.TLSVersion.TLSv1_3, 'TLSv1.3')):
+            context.maximum_version = version
+            server = threading.Thread(target=serve)
+            server.daemon = True
+            server.start()
+            tls = ReusableTls('localhost')
+            for i in range(3):
+                conn = Connection()
+                conn.socket = socket.create_connection(
+                    listener.getsockname())
+                tls.wrap_socket(conn, do_handshake=True)
+                self.assertEqual(conn.socket.version(), name)
+                self.assertEqual(conn.socket.recv(1), b'x')
+                tls.remember(conn.socket)
+                conn.socket.close()
+            server.join(5)
+            stats = tls.stats()
+            self.assertEqual(stats['handshakes'], 3)
+            self.assertEqual(stats['resumed'], 2)
+            self.assertGreater(stats['handshake_time'], 0)
+
+        # The host name is checked when the certificate is validated
+        server = threading.Thread(target=serve, args=(2,))
+        server.daemon = True
+        server.start()
+        for host in ('localhost', 'ldap.example.org'):
+            conn = Connection()
+            conn.socket = socket.create_connection(listener.getsockname())
+            tls = ReusableTls(host, 'optional', cert)
+            if host == 'localhost':
+                tls.wrap_socket(conn, do_handshake=True)
+            else:
+                self.assertRaises(LDAPCertificateError, tls.wrap_socket,
+                                  conn, do_handshake=True)
+            conn.socket.close()
+        server.join(5)
+
+    def test_no_tls(self):
+        from who_ldap import get_client
+        self.assertEqual(get_client('ldap://plain.example.org').tls_stats(),
+                         {})
+        self.assertRaises(AssertionError, get_client,
+                          'ldaps://tls.example.org', tls_validate='maybe')
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """Tests for the L{AdmissionControl} of the servers"""
+
+    def test_unlimited(self):
+        from who_ldap import AdmissionControl
+        admission = AdmissionControl('ldap://a')
+        with admission.slot():
+            self.assertEqual(admission.stats()['running'], 0)
+
+    def test_rejected(self):
+        from who_ldap import AdmissionControl, ServerBusyError
+        admission = AdmissionControl('ldap://a', 1, max_queue=0)
+        with admission.slot():
+            self.assertEqual(admission.stats()['running'], 1)
+            self.assertRaises(ServerBusyError, admission.acquire)
+        self.assertEqual(admission.stats()['running'], 0)
+        self.assertEqual(admission.stats()['rejected'], 1)
+
+    def test_timed_out(self):
+        from who_ldap import AdmissionControl, ServerBusyError
+        admission = AdmissionControl('ldap://a', 1, queue_timeout=0.01)
+        with admission.slot():
+            self.assertRaises(ServerBusyError, admission.acquire)
+        stats = admission.stats()
+        self.assertEqual((stats['queued'], stats['timed_out']), (0, 1))
+
+    def test_priority(self):
+        import threading
+        import time
+        from who_ldap import AdmissionControl
+        admission = AdmissionControl('ldap://a', 1)
+        admitted = []
+
+        def run(priority):
+            with admission.slot(priority):
+                admitted.append(priority)
+
+        threads = [threading.Thread(target=run, args=(p,)) for p in (1, 0)]
+        with admission.slot():
+            for queued, thread in enumerate(threads):
+                thread.start()
+                while admission.stats()['queued'] == queued:
+                    time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        self.assertEqual(admitted, [0, 1])
+        self.assertEqual(admission.stats()['waited'], 2)
+
+    def test_plugins_shed(self):
+        from who_ldap import LDAPAttributesPlugin
+        from who_ldap import LDAPSearchAuthenticatorPlugin
+        url = 'ldap://shed.example.org'
+        auth = LDAPSearchAuthenticatorPlugin(
+            url, BASE_DN, max_concurrency=1, max_queue=0,
+            max_login_failures=1)
+        attributes = LDAPAttributesPlugin(url, max_concurrency=1)
+        env = {}
+        identity = {'login': fakeuser['uid'],
+                    'password': fakeuser['password'],
+                    'userdata': {'dn': fakeuser['dn']}}
+        with auth.client.admission.slot():
+            self.assertIsNone(auth.authenticate(env, identity))
+            attributes.add_metadata(env, identity)
+        self.assertTrue(env['who_ldap.busy'])
+        self.assertNotIn('mail', identity)
+        self.assertTrue(auth.throttle.allows(env, fakeuser['uid']))
+
+    def test_shared(self):
+        from who_ldap import LDAPSearchAuthenticatorPlugin
+        from who_ldap import LDAPGroupsPlugin
+        url = 'ldap://admission.example.org'
+        auth = LDAPSearchAuthenticatorPlugin(
+            url, BASE_DN, max_concurrency=4, queue_timeout=1)
+        groups = LDAPGroupsPlugin(
+            url, BASE_DN, BIND_DN, BIND_PW, max_concurrency=2)
+        self.assertIs(auth.client.admission, groups.client.admission)
+        self.assertEqual(auth.client.admission.max_concurrency, 2)
+        # Unset in the groups plugin, the timeout isn't the default
+        self.assertEqual(auth.client.admission.queue_timeout, 1)
+        self.assertEqual(auth.client.admission.max_queue, 100)
+        LDAPGroupsPlugin(url, BASE_DN, max_queue=10, queue_timeout='3')
+        self.assertEqual(auth.client.admission.max_queue, 10)
+        self.assertEqual(auth.client.admission.queue_timeout, 3)
+        self.assertLess(auth.priority, groups.priority)
+
+
+class TestWarmUp(unittest.TestCase):
+    """Tests for warming up the connections of the plugins"""
+
+    def test_warm_up(self):
+        from who_ldap import LDAPAttributesPlugin
+        plugin = LDAPAttributesPlugin(BIND_URI, BIND_DN, BIND_PW, warm_up=2)
+        self.assertGreaterEqual(len(plugin.client.pool._idle), 2)
+        self.assertGreaterEqual(plugin.client.warm_size, 2)
+
+    def test_forked(self):
+        import who_ldap
+        client = who_ldap.get_client(BIND_URI, BIND_DN, BIND_PW)
+        self.assertEqual(client.warm_up(1), 1)
+        who_ldap._pid = None  # as if the process had forked
+        with client.connection() as conn:
+            self.assertTrue(conn.bound)
+        self.assertEqual(who_ldap._pid, os.getpid())
+
+    def test_warm_up_count(self):
+        from who_ldap import parse_count
+        self.assertEqual([parse_count(v) for v in
+                          (True, 'true', 'False', None, '', 0, '2', 3)],
+                         [1, 1, 0, 0, 0, 0, 2, 3])
+        self.assertRaises(ValueError, parse_count, 'some')
+
+    def test_forked_lazily(self):
+        import who_ldap
+        client = who_ldap.get_client('ldap://forked.example.org')
+        client.warm_size = 1
+        warmed = []
+        client.warm_up_background = lambda: warmed.append(client)
+        who_ldap._pid = None  # as if the process had forked
+        who_ldap.reset_fork()  # as done right after the fork
+        self.assertEqual(warmed, [])
+        who_ldap.check_fork()  # as done when using a client
+        who_ldap.check_fork()
+        self.assertEqual(warmed, [client])
+
+    def test_forked_locks(self):
+        import who_ldap
+        cache = who_ldap.LRUCache()
+        cache._lock.acquire()  # as if held by another thread when forking
+        who_ldap._pid = None
+        who_ldap.check_fork()
+        self.assertFalse(cache._lock.locked())
+        self.assertEqual(who_ldap._pid, os.getpid())
+
+
+class TestAuthenticationThrottle(Base):
+    """Tests for the L{AuthenticationThrottle} of the authenticators"""
+
+    def makeThrottle(self, **kw):
+        from who_ldap import AuthenticationThrottle
+        return AuthenticationThrottle(**kw)
+
+    def test_disabled(self):
+        throttle = self.makeThrottle()
+        env = self.makeEnviron({'REMOTE_ADDR': '10.0.0.1'})
+        for i in range(100):
+            throttle.failed(env, fakeuser['uid'])
+        self.assertTrue(throttle.allows(env, fakeuser['uid']))
+
+    def test_login_backoff(self):
+        throttle = self.makeThrottle(max_login_failures=2, backoff=60)
+        env = self.makeEnviron()
+        throttle.failed(env, fakeuser['uid'])
+        self.assertTrue(throttle.allows(env, fakeuser['uid']))
+        throttle.failed(env, fakeuser['uid'])
+        self.assertFalse(throttle.allows(env, fakeuser['uid']))
+        self.assertEqual(env['who_ldap.throttled'], 'login')
+        self.assertEqual(throttle.shed, {'login': 1})
+        self.assertTrue(throttle.allows(env, 'someone else'))
+        throttle.succeeded(env, fakeuser['uid'])
+        self.assertTrue(throttle.allows(env, fakeuser['uid']))
+
+    def test_login_case(self):
+        throttle = self.makeThrottle(max_login_failures=1, backoff=60)
+        env = self.makeEnviron()
+        throttle.failed(env, 'carla')
+        self.assertFalse(throttle.allows(env, 'Carla'))
+        self.assertFalse(throttle.allows(env, ' CARLA '))
+        throttle.succeeded(env, 'Carla ')
+        self.assertTrue(throttle.allows(env, 'carla'))
+
+    def test_client_is_not_forgiven(self):
+        throttle = self.makeThrottle(max_client_failures=1, backoff=60)
+        env = self.makeEnviron({'REMOTE_ADDR': '10.0.0.1'})
+        throttle.failed(env, 'someone else')
+        throttle.succeeded(env, fakeuser['uid'])
+        self.assertFalse(throttle.allows(env, fakeuser['uid']))
+        self.assertTrue(throttle.allows(self.makeEnviron(), fakeuser['uid']))
+
+    def test_window_expires(self):
+        from who_ldap import SlidingWindowCounter
+        counter = SlidingWindowCounter(1, window=10, backoff=60)
+        counter.failed('carla', now=100)
+        self.assertFalse(counter.allows('carla', now=105))
+        self.assertTrue(counter.allows('carla', now=111))
+
+    def test_authenticate_throttled(self):
+        from who_ldap import LDAPAuthenticatorPlugin
+        plugin = LDAPAuthenticatorPlugin(
+            BIND_URI, BASE_DN, max_login_failures=1, failure_backoff=60)
+        env = self.makeEnviron()
+        identity = {'login': fakeuser['uid'],
+                    'password': 'wrong password'}
+        self.assertIsNone(plugin.authenticate(env, identity))
+        identity = {'login': fakeuser['uid'],
+                    'password': fakeuser['password']}
+        self.assertIsNone(plugin.authenticate(env, identity))
+        self.assertEqual(plugin.throttle.shed, {'login': 1})
+
+
 class TestLDAPAuthenticatorPluginStartTls(Base):
     """Tests for the L{LDAPAuthenticatorPlugin} IAuthenticator plugin"""
 
@@ -398,6 +991,212 @@ class TestMakeLDAPAttributesPlugin(unittest.TestCase, AssertMixin):
         LDAPAttributesPlugin(BIND_URI, 'cn', '(objectClass=*)')
 
 
+class TestFilterTemplate(unittest.TestCase):
+    """Tests for the L{FilterTemplate} of the metadata plugins"""
+
+    def test_render(self):
+        from who_ldap import FilterTemplate
+        template = FilterTemplate(
+            '(& (objectClass=person) (uid={identity[login]}))')
+        self.assertEqual(template.render({'login': 'ca*rla'}),
+                         '(&(objectClass=person)(uid=ca\\2arla))')
+        self.assertIsNone(template.render({}))
+
+    def test_render_percent(self):
+        from who_ldap import FilterTemplate
+        template = FilterTemplate('(uniqueMember=%(dn)s)', '%', ('dn',))
+        self.assertEqual(template.render({'dn': fakeuser['dn']}),
+                         '(uniqueMember=%s)' % fakeuser['dn'])
+
+    def test_extensible(self):
+        from who_ldap import FilterTemplate
+        for filterstr in ('(:dn:2.4.6.8.10:=Dino)', '(cn:dn:=Dino)',
+                          '(&(o:caseExactMatch:=Ace)(sn:2.5.13.5:=x))'):
+            self.assertEqual(FilterTemplate(filterstr).render({}), filterstr)
+
+    def test_invalid(self):
+        from who_ldap import FilterTemplate
+        self.assertRaises(ValueError, FilterTemplate, '(uid={login})')
+        self.assertRaises(ValueError, FilterTemplate, '(uid=x')
+        self.assertRaises(ValueError, FilterTemplate, '(&)')
+        self.assertRaises(ValueError, FilterTemplate,
+                          '(uid=%(login)s)', '%', ('dn',))
+        from who_ldap import LDAPGroupsPlugin
+        self.assertRaises(ValueError, LDAPGroupsPlugin, BIND_URI, BASE_DN,
+                          filterstr='(member=%(dn)s')
+
+
+class TestOperationLog(unittest.TestCase):
+    """Tests for the L{OperationLog} of the plugins"""
+
+    def test_disabled(self):
+        from who_ldap import OperationLog, NULL_OPERATION
+        log = OperationLog('plugin')
+        environ = {}
+        self.assertIs(log.operation(environ, 'search', BASE_DN),
+                      NULL_OPERATION)
+        self.assertEqual(environ, {})
+
+    def test_trace(self):
+        from who_ldap import OperationLog
+        log = OperationLog('plugin', trace_sample=1)
+        other = OperationLog('other')
+        environ = {}
+        with log.operation(environ, 'search', BASE_DN, '(uid=carla)') as op:
+            op.done(None, 1)
+        with other.operation(environ, 'bind', fakeuser['dn']):
+            pass
+        trace = environ['who_ldap.trace']
+        self.assertEqual([(e['plugin'], e['operation']) for e in trace],
+                         [('plugin', 'search'), ('other', 'bind')])
+        self.assertEqual(trace[0]['filter'], '(uid=?)')
+        self.assertEqual(trace[0]['results'], 1)
+        self.assertGreaterEqual(trace[0]['duration'], 0)
+
+    def test_user_dn(self):
+        from who_ldap import OperationLog
+        log = OperationLog('plugin', trace_sample=1)
+        environ = {}
+        with log.operation(environ, 'bind', fakeuser['dn'], user_dn=True):
+            pass
+        with log.operation(environ, 'search', BASE_DN, '(uid=carla)'):
+            pass
+        trace = environ['who_ldap.trace']
+        self.assertEqual(trace[0]['base_dn'], 'uid=?,%s' % BASE_DN)
+        self.assertEqual(trace[1]['base_dn'], BASE_DN)
+
+    def test_mask_dn(self):
+        from who_ldap import mask_dn
+        self.assertEqual(mask_dn('cn=Carla+uid=carla, %s' % BASE_DN),
+                         'cn=?+uid=?,%s' % BASE_DN)
+        self.assertEqual(mask_dn('not a DN'), '?')
+
+    def test_not_sampled(self):
+        from who_ldap import OperationLog, NULL_OPERATION
+        log = OperationLog('plugin', trace_sample=0.000001)
+        environ = {'who_ldap.trace': None}
+        self.assertIs(log.operation(environ, 'search', BASE_DN),
+                      NULL_OPERATION)
+        self.assertRaises(AssertionError, OperationLog, 'plugin',
+                          trace_sample=2)
+
+    def test_slow(self):
+        import logging
+        import time
+        from who_ldap import OperationLog
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        logger = logging.getLogger('repoze.who')
+        logger.addHandler(handler)
+        try:
+            log = OperationLog('plugin', slow_threshold=0.001)
+            with log.operation({}, 'search', BASE_DN, '(uid=carla)'):
+                time.sleep(0.05)
+            log.slow_threshold = 60
+            with log.operation({}, 'search', BASE_DN, '(uid=carla)'):
+                pass
+        finally:
+            logger.removeHandler(handler)
+        self.assertEqual(len(records), 1)
+        self.assertIn('(uid=?)', records[0].getMessage())
+
+    def test_normalize_filter(self):
+        from who_ldap import normalize_filter
+        self.assertEqual(
+            normalize_filter('(& (objectClass=*)(|(uid=a\\29b)(n>=1)))'),
+            '(&(objectClass=*)(|(uid=?)(n>=?)))')
+
+
+class TestGroupResolver(unittest.TestCase):
+    """Tests for the L{GroupResolver} of L{LDAPGroupsPlugin}"""
+
+    def test_resolve_rdn(self):
+        from who_ldap import GroupResolver
+        resolver = GroupResolver('cn', base_dn=DOMAIN_DN)
+        dns = ['cn=Ad\\2cmins,%s' % DOMAIN_DN, 'CN=staff,%s' % DOMAIN_DN]
+        # No search is needed, hence no connection
+        self.assertEqual(resolver.resolve(None, dns),
+                         ['Ad,mins', 'staff'])
+
+    def test_resolve_rdn_scope(self):
+        from who_ldap import GroupResolver
+        from ldap3 import LEVEL
+        dns = ['cn=admins,ou=groups,%s' % DOMAIN_DN,
+               'cn=staff,ou=teams,ou=groups,%s' % DOMAIN_DN,
+               'cn=people,ou=Groups,%s' % DOMAIN_DN,
+               'cn=other,ou=groups,dc=example,dc=net']
+        # The groups out of the scope of the base are searched for instead
+        resolver = GroupResolver('cn', base_dn='ou=groups,%s' % DOMAIN_DN)
+        conn = StubConnection()
+        self.assertEqual(resolver.resolve(conn, dns),
+                         ['admins', 'staff', 'people'])
+        self.assertEqual(conn.searches[0][1], '(|(entryDN=%s))' % dns[3])
+        resolver = GroupResolver('cn', base_dn='OU=Groups, %s' % DOMAIN_DN,
+                                 search_scope=LEVEL)
+        conn = StubConnection()
+        self.assertEqual(resolver.resolve(conn, dns), ['admins', 'people'])
+        self.assertEqual(conn.searches[0][2], LEVEL)
+
+    def test_cached(self):
+        from who_ldap import GroupResolver
+        resolver = GroupResolver('cn', resolve_rdn=False, base_dn=DOMAIN_DN)
+        resolver.prime('gidNumber=1, %s' % DOMAIN_DN, 'admins')
+        dns = ['gidNumber=1,%s' % DOMAIN_DN]
+        self.assertEqual(resolver.resolve(None, dns), ['admins'])
+
+    def test_search(self):
+        from who_ldap import GroupResolver
+        resolver = GroupResolver('cn', resolve_rdn=False, base_dn=DOMAIN_DN)
+        dns = ['gidNumber=%s,%s' % (i, DOMAIN_DN) for i in (1, 2, 3)]
+        conn = StubConnection(response=[
+            {'type': 'searchResEntry', 'dn': dns[0],
+             'attributes': {'cn': ['admins']}},
+            {'type': 'searchResEntry', 'dn': dns[2],
+             'attributes': {'cn': ['staff']}}])
+        self.assertEqual(resolver.resolve(conn, dns),
+                         ['admins', 'staff'])
+        self.assertEqual(len(conn.searches), 1)
+        self.assertEqual(conn.searches[0][1],
+                         '(|(entryDN=%s)(entryDN=%s)(entryDN=%s))' %
+                         tuple(dns))
+        # Found or not, the groups are cached
+        self.assertEqual(resolver.resolve(conn, dns),
+                         ['admins', 'staff'])
+        self.assertEqual(len(conn.searches), 1)
+
+    def test_search_failed(self):
+        from who_ldap import GroupResolver
+        resolver = GroupResolver('cn', resolve_rdn=False, base_dn=DOMAIN_DN)
+        dns = ['gidNumber=%s,%s' % (i, DOMAIN_DN) for i in (1, 2)]
+        conn = StubConnection('sizeLimitExceeded', response=[
+            {'type': 'searchResEntry', 'dn': dns[0],
+             'attributes': {'cn': ['admins']}}])
+        self.assertEqual(resolver.resolve(conn, dns), ['admins'])
+        conn = StubConnection(response=[
+            {'type': 'searchResEntry', 'dn': dns[1],
+             'attributes': {'cn': ['staff']}}])
+        self.assertEqual(resolver.resolve(conn, dns),
+                         ['admins', 'staff'])
+        self.assertEqual(conn.searches[0][1], '(|(entryDN=%s))' % dns[1])
+
+    def test_shared(self):
+        from who_ldap import LDAPGroupsPlugin
+        plugin1 = LDAPGroupsPlugin(BIND_URI, DOMAIN_DN, name='groups')
+        plugin2 = LDAPGroupsPlugin(BIND_URI, DOMAIN_DN.upper(),
+                                   member_attribute='memberOf')
+        self.assertIs(plugin1.resolver, plugin2.resolver)
+        # Groups found (or not) below another base or with another scope
+        # aren't those of the plugin
+        plugin3 = LDAPGroupsPlugin(BIND_URI, BASE_DN,
+                                   member_attribute='memberOf')
+        plugin4 = LDAPGroupsPlugin(BIND_URI, DOMAIN_DN, search_scope='one',
+                                   member_attribute='memberOf')
+        self.assertIsNot(plugin1.resolver, plugin3.resolver)
+        self.assertIsNot(plugin1.resolver, plugin4.resolver)
+        self.assertEqual(plugin3.resolver.base_dn, BASE_DN)
+
+
 class TestLDAPAttributesPlugin(Base):
     """Tests for the L{LDAPAttributesPlugin} IMetadata plugin"""
 